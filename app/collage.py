@@ -29,11 +29,132 @@
 
 
 import os
+import sys
 import argparse
+import hashlib
+import json
 import random
+import time
+import fnmatch
+import cProfile
+from collections import deque
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
 import math
 
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is not reported there
+    resource = None
+
+from collage_cache import ImageCache, DEFAULT_CACHE_SIZE
+from collage_png import PngStreamWriter, temp_path
+
+try:
+    import numpy as np
+except ImportError:  # optional, enables the vectorized layout engine
+    np = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_EXTENSIONS = (".heic", ".heif")
+except ImportError:  # optional, adds HEIF/HEIC input
+    HEIF_EXTENSIONS = ()
+
+# EXIF orientation tag and the values that swap width and height
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Formats whose EXIF block is read with the header, so getexif() does not decode pixel data
+HEADER_EXIF_FORMATS = ("JPEG", "MPO", "WEBP", "TIFF", "HEIF")
+
+# Formats that Pillow (or pillow-heif) already reports upright: the size is transposed and the pixels
+# are rotated on load, so their EXIF orientation must not be applied again
+AUTO_ORIENTED_FORMATS = ("TIFF", "HEIF")
+
+# Shuffles scored per array operation by the numpy layout engine
+NUMPY_BATCH = 256
+
+# Best numpy candidates per batch that are rescored exactly when scoring by coverage
+NUMPY_RESCORE = 8
+
+# The image cache keeps power-of-two reductions of each source (1/2, 1/4, ...),
+# from the first one with a longest side of at most PYRAMID_MAX_SIDE down to PYRAMID_MIN_SIDE
+PYRAMID_MAX_SIDE = 2048
+PYRAMID_MIN_SIDE = 256
+
+# Input files by extension
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff") + HEIF_EXTENSIONS
+
+# Threads that stat files and read image headers while scanning (mostly waiting on I/O, e.g. network mounts),
+# and how many files are handed to them at a time
+SCAN_WORKERS = 16
+SCAN_CHUNK = 256
+
+# Rough upper bound of the memory one header read takes (file buffer, EXIF block, embedded thumbnails)
+SCAN_WORKER_MEMORY = 4 * 1024*1024
+
+# A stratified sample is drawn from a uniform reservoir this many times larger than the sample,
+# so only the reservoir's headers have to be read
+SAMPLE_OVERSAMPLING = 4
+STRATIFY_MODES = ("aspect", "date")
+
+# Layout engines: shuffled rows with a random search, or rows partitioned by dynamic programming
+LAYOUT_MODES = ("organic", "justified")
+
+# Incremental updates lay out everything again once more than this share of the images was added or removed
+INCREMENTAL_MAX_CHANGE = 0.25
+
+# Output formats by file extension, and the quality used when none is given
+OUTPUT_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP"}
+DEFAULT_QUALITY = 90
+
+# Resampling tiers for tiles. Pillow's affine transform has no Lanczos filter, so "lanczos" (the default)
+# resizes first and then rotates like Image.rotate; the faster tiers resize and rotate in one transform.
+RESAMPLE_FILTERS = {"nearest": Image.NEAREST, "bilinear": Image.BILINEAR, "bicubic": Image.BICUBIC,
+                    "lanczos": Image.LANCZOS}
+DEFAULT_RESAMPLE = "lanczos"
+
+# Modes that Image.reduce can average without converting first (palette indices cannot be averaged)
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+
+# Longest side of the preview canvas and of the thumbnails it is rendered from
+PREVIEW_SIDE = 640
+PREVIEW_THUMB_SIDE = 192
+
+class CollageCancelled(Exception):
+    """
+    Raised when the cancel hook of create_collage asks to stop
+    """
+
+def report(progress, cancel, stage, done, total=None):
+    # Forward progress (stage, done, total; total None if unknown) and stop if the caller cancelled
+    if cancel is not None and cancel():
+        raise CollageCancelled(f"Cancelled during {stage}")
+    if progress is not None:
+        progress(stage, done, total)
+
+@contextmanager
+def process_pool(workers, **kwargs):
+    # Process pool that drops queued work when the caller fails or is cancelled
+    pool = ProcessPoolExecutor(max_workers=workers, **kwargs)
+    try:
+        yield pool
+    finally:
+        pool.shutdown(cancel_futures=True)
+
 def parse_color(c):
     c = str(c).strip().lower()
     if c == "transparent":
@@ -48,144 +169,1571 @@ def parse_color(c):
         return tuple(parts[:3])
     raise ValueError("Invalid color. Use ‘#RRGGBB’, ‘R,G,B’, or ‘transparent’.")
 
-def load_images(input_dir):
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith((".jpg",".jpeg",".png"))]
+def read_image_info(path):
+    """
+    Read dimensions and EXIF orientation from the file header without decoding pixel data
+    """
+    with Image.open(path) as img:
+        w, h = img.size
+        if img.format in AUTO_ORIENTED_FORMATS:
+            exif = Image.Exif()
+        elif img.format in HEADER_EXIF_FORMATS:
+            exif = img.getexif()
+        else:
+            # PNG's getexif() decodes the whole image when there is no eXIf chunk before the pixel data
+            exif = Image.Exif()
+            if img.info.get("exif"):
+                exif.load(img.info["exif"])
+        orientation = exif.get(EXIF_ORIENTATION, 1)
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        w, h = h, w
+    return {"w": w, "h": h, "orientation": orientation}
+
+def walk_images(input_dir, recursive=False, include=None, exclude=None, max_files=None):
+    """
+    Stream (name, path) of image files below input_dir, name being the path relative to input_dir.
+    Directories are read with os.scandir and visited in name order, so the result is deterministic.
+    include/exclude are glob patterns matched against the relative path; excluded directories are not entered.
+    """
+    count = 0
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(input_dir, rel_dir)) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            if not rel_dir:
+                raise
+            continue  # unreadable subdirectory
+        subdirs = []
+        for entry in entries:
+            name = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if exclude and any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+                continue
+            try:
+                # Symlinked folders are not followed, so links back up the tree cannot loop
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if recursive:
+                    subdirs.append(name)
+                continue
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if include and not any(fnmatch.fnmatch(name, pattern) for pattern in include):
+                continue
+            yield name, entry.path
+            count += 1
+            if max_files is not None and count >= max_files:
+                return
+        stack.extend(reversed(subdirs))
+
+def scan_image(name, path, cache):
+    # Item for one file, None if it cannot be read as an image
+    try:
+        if cache is None:
+            return {"name": name, "path": path, **read_image_info(path)}
+        key = cache.key_for(path)
+        info = cache.load_info(key)
+        if info is None:
+            info = read_image_info(path)
+            cache.store_info(key, info)
+    except OSError as e:  # includes PIL.UnidentifiedImageError
+        print(f"Skipping {name}: {e}")
+        return None
+    return {"name": name, "path": path, "key": key, "w": info["w"], "h": info["h"], "orientation": info["orientation"]}
+
+def reservoir_sample(stream, k, rng):
+    """
+    Uniform sample of k elements from a stream of unknown length in one pass (Algorithm R), in stream order
+    """
+    sample = []
+    for i, x in enumerate(stream):
+        if i < k:
+            sample.append((i, x))
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                sample[j] = (i, x)
+    return [x for _, x in sorted(sample, key=lambda s: s[0])]
+
+def aspect_class(item):
+    ratio = item["w"] / item["h"]
+    return "portrait" if ratio < 0.9 else "landscape" if ratio > 1.1 else "square"
+
+def stratified_sample(items, k, stratify, rng):
+    """
+    Select k items keeping the mix of aspect classes ("aspect") or spreading evenly over the
+    modification dates ("date"); the selection keeps the order of items
+    """
+    if len(items) <= k:
+        return items
+    indexed = list(enumerate(items))
+    if stratify == "date":
+        # One item from each of k consecutive date ranges of equal count
+        indexed.sort(key=lambda x: (os.stat(x[1]["path"]).st_mtime, x[0]))
+        chosen = [rng.choice(indexed[i * len(indexed) // k:(i + 1) * len(indexed) // k]) for i in range(k)]
+    else:
+        groups = {}
+        for x in indexed:
+            groups.setdefault(aspect_class(x[1]), []).append(x)
+        # Quotas proportional to the group sizes, remaining places go to the largest remainders
+        names = sorted(groups)
+        quotas = {name: k * len(groups[name]) // len(items) for name in names}
+        by_remainder = sorted(names, key=lambda name: (-(k * len(groups[name]) % len(items)), name))
+        for name in by_remainder[:k - sum(quotas.values())]:
+            quotas[name] += 1
+        chosen = [x for name in names for x in rng.sample(groups[name], quotas[name])]
+    return [item for _, item in sorted(chosen, key=lambda x: x[0])]
+
+def image_limit(width, height, max_images=None, tile_size=None):
+    # Images to use at most: max_images and/or as many tiles of about tile_size x tile_size as fit the canvas
+    limits = [n for n in (max_images, tile_size and max(1, (width * height) // (tile_size * tile_size))) if n]
+    return min(limits) if limits else None
+
+def load_images(input_dir, cache=None, progress=None, cancel=None, recursive=False, include=None, exclude=None,
+                max_files=None, scan_workers=SCAN_WORKERS, max_images=None, stratify=None, seed=0, max_memory=None):
+    """
+    Scan input_dir for images (see walk_images) and read their dimensions and orientation.
+    Files are stat'ed and their headers read on scan_workers threads while the listing is still streaming;
+    unreadable files are skipped. With max_images, a random sample (reproducible by seed) is drawn from the
+    listing before any header is read, optionally stratified by "aspect" or "date" (see stratified_sample).
+    With max_memory (bytes), fewer threads are used if their header reads would not fit into it.
+    """
+    if max_memory is not None:
+        scan_workers = min(scan_workers, max_memory // SCAN_WORKER_MEMORY)
+    files = walk_images(input_dir, recursive, include, exclude, max_files)
+    rng = random.Random(derive_seed(seed, "sample"))
+    if max_images is not None:
+        files = iter(reservoir_sample(files, max_images * (SAMPLE_OVERSAMPLING if stratify else 1), rng))
     items = []
-    for f in files:
-        img = Image.open(os.path.join(input_dir, f)).convert("RGBA")
-        w,h = img.size
-        items.append({"name": f, "img": img, "w": w, "h": h})
+    scanned = 0
+    with ThreadPoolExecutor(max_workers=max(1, scan_workers)) as pool:
+        while True:
+            chunk = [f for _, f in zip(range(SCAN_CHUNK), files)]
+            if not chunk:
+                break
+            for item in pool.map(lambda f: scan_image(f[0], f[1], cache), chunk):
+                report(progress, cancel, "loading", scanned)
+                scanned += 1
+                if item is not None:
+                    items.append(item)
+    report(progress, cancel, "loading", scanned, scanned)
+    if max_images is not None and stratify:
+        items = stratified_sample(items, max_images, stratify, rng)
     return items
 
-def compute_layout(items, canvas_width, canvas_height, rows, overlap_factor, iterations):
+def decode_reduced(img, width, height):
+    """
+    Decode at the smallest resolution that is still at least width x height
+    """
+    # JPEG: let the decoder scale by 1/2, 1/4 or 1/8 in the DCT domain
+    img.draft(None, (width, height))
+    factor = min(img.width // width, img.height // height)
+    if factor > 1:
+        if img.mode not in REDUCIBLE_MODES:
+            img = img.convert("RGBA")
+        img = img.reduce(factor)
+    return img
+
+def build_pyramid(item):
+    # Decode once at the first level (DCT scaling for JPEG), then halve with a box filter
+    factor = 2
+    while max(item["w"], item["h"]) / factor > PYRAMID_MAX_SIDE:
+        factor *= 2
+    img = open_image(item, (max(1, item["w"] // factor), max(1, item["h"] // factor)))
+    levels = []
+    while max(img.size) >= PYRAMID_MIN_SIDE:
+        levels.append(img)
+        img = img.reduce(2)
+    return levels
+
+def open_cached(item, size, cache):
+    """
+    Return the smallest cached pyramid level that is at least size, building the pyramid on first use.
+    None if no level is large enough and the source has to be decoded.
+    """
+    key = item["key"]
+    if cache.has_levels(key):
+        return cache.load_level(key, size)
+    levels = build_pyramid(item)
+    cache.store_levels(key, {"w": item["w"], "h": item["h"], "orientation": item["orientation"]}, levels)
+    fitting = [img for img in levels if img.width >= size[0] and img.height >= size[1]]
+    return fitting[-1] if fitting else None
+
+def open_image(item, size=None, cache=None):
+    """
+    Decode an image for compositing, upright according to its EXIF orientation.
+    With size, decoding is reduced as far as possible while staying at least that size.
+    """
+    if cache is not None and size and "key" in item:
+        img = open_cached(item, size, cache)
+        if img is not None:
+            return img
+    orientation = item.get("orientation", 1)
+    with Image.open(item["path"]) as img:
+        if img.format in AUTO_ORIENTED_FORMATS:
+            orientation = 1
+        if size:
+            w, h = size
+            if orientation in TRANSPOSED_ORIENTATIONS:
+                w, h = h, w
+            img = decode_reduced(img, max(1, w), max(1, h))
+        if orientation in ORIENTATION_TRANSPOSE:
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+        return img.convert("RGBA")
+
+def derive_seed(seed, *keys):
+    # Stable seed per candidate, independent of process and hash randomization
+    data = ":".join(str(k) for k in (seed,) + keys).encode()
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], "big")
+
+def candidate_rng(seed, rows, it):
+    return random.Random(derive_seed(seed, rows, it))
+
+def resolve_engine(engine):
+    if engine == "auto":
+        return "numpy" if np is not None else "python"
+    if engine == "numpy" and np is None:
+        raise ValueError("The numpy layout engine requires NumPy to be installed.")
+    return engine
+
+def estimate_rows(items, canvas_width, canvas_height):
+    # Rows at which n tiles of mean aspect ratio fill the canvas: r^2 = n * aspect * height / width
+    aspect = sum(item["w"] / item["h"] for item in items) / len(items)
+    rows = round(math.sqrt(len(items) * aspect * canvas_height / canvas_width))
+    return min(max(rows, 1), len(items))
+
+def compute_layout(items, canvas_width, canvas_height, rows, overlap_factor, iterations, seed=0, workers=1, engine="auto",
+                   row_search="pruned", stats=None, scoring="coverage", max_rotation=0, progress=None, cancel=None,
+                   layout_mode="organic"):
     n = len(items)
-    if rows <= 0:
-        # Automatic selection: try 1..n rows
-        best_layout = None
-        best_score = None
-        for r in range(1, n+1):
-            layout, score = try_layout(items, canvas_width, canvas_height, r, overlap_factor, iterations)
-            if best_score is None or score < best_score:
-                best_score = score
-                best_layout = layout
-        return best_layout
-    else:
-        layout, _ = try_layout(items, canvas_width, canvas_height, rows, overlap_factor, iterations)
+    if layout_mode == "justified":
+        report(progress, cancel, "layout", 0, 1)
+        layout, best_rows, row_counts = justified_layout(items, canvas_width, canvas_height, rows, overlap_factor, seed)
+        if stats is not None:
+            stats.update(rows=best_rows, row_counts=row_counts, candidates=row_counts)
+        report(progress, cancel, "layout", 1, 1)
         return layout
 
-def try_layout(items, canvas_width, canvas_height, rows, overlap_factor, iterations):
+    workers = resolve_workers(workers)
+    context = {
+        "items": items,
+        "canvas_width": canvas_width,
+        "canvas_height": canvas_height,
+        "overlap_factor": overlap_factor,
+        "seed": seed,
+        "engine": resolve_engine(engine),
+        "scoring": scoring,
+        # Rotation angles depend only on the seed and the tile index, so candidates can be scored with them
+        "angles": rotation_angles(seed, n, max_rotation) if scoring == "rotated" else None,
+    }
+    evaluated = []
+    # Candidates to evaluate, unknown for the pruned search
+    total = iterations if rows > 0 else n * iterations if row_search == "exhaustive" else None
+
+    if workers > 1:
+        pool_context = process_pool(workers, initializer=init_search, initargs=(context,))
+    else:
+        pool_context = nullcontext()
+
+    with pool_context as pool:
+        def evaluate(row_counts):
+            # numpy tasks cover whole batches, so the candidates rescored per batch do not depend on chunking
+            align = NUMPY_BATCH if context["engine"] == "numpy" else 1
+            tasks = split_candidates(row_counts, iterations, workers, align)
+            if pool is not None and len(tasks) > 1:
+                results = pool.map(search_worker, tasks)
+            else:
+                results = (search_candidates(context, task) for task in tasks)
+            batch = []
+            done = len(evaluated) * iterations
+            for (_, start, end), result in zip(tasks, results):
+                done += end - start
+                report(progress, cancel, "layout", done, total)
+                if result is not None:
+                    batch.append(result)
+            evaluated.extend(row_counts)
+            return batch
+
+        if rows > 0:
+            results = evaluate([rows])
+        elif row_search == "exhaustive":
+            # Automatic selection: try 1..n rows
+            results = evaluate(list(range(1, n+1)))
+        else:
+            results = search_rows_pruned(evaluate, n, estimate_rows(items, canvas_width, canvas_height))
+
+    if not results:
+        return None
+    # Deterministic reduction: lowest score, ties go to fewer rows, then earlier iteration
+    _, best_rows, best_it = min(results)
+    if stats is not None:
+        stats.update(rows=best_rows, row_counts=len(evaluated), candidates=len(evaluated) * iterations)
+    layout, _ = build_candidate(context, best_rows, best_it)
+    return layout
+
+def search_rows_pruned(evaluate, n, estimate, radius=2, patience=2):
+    """
+    Evaluate a window of row counts around the estimate and widen it in each direction
+    while the best score keeps improving
+    """
+    lo = max(1, estimate - radius)
+    hi = min(n, estimate + radius)
+    results = evaluate(list(range(lo, hi+1)))
+    for direction, edge in ((-1, lo), (1, hi)):
+        while True:
+            step = [edge + direction*i for i in range(1, patience+1) if 1 <= edge + direction*i <= n]
+            if not step:
+                break
+            batch = evaluate(step)
+            improved = batch and (not results or min(batch) < min(results))
+            results += batch
+            if not improved:
+                break
+            edge = step[-1]
+    return results
+
+def split_candidates(row_counts, iterations, workers, align=1):
+    # Split the (rows, iteration) grid into tasks; iterations are chunked when there are few row counts
+    chunks = max(1, min(iterations, math.ceil(workers * 4 / len(row_counts)))) if workers > 1 else 1
+    size = math.ceil(math.ceil(iterations / chunks) / align) * align
+    return [(r, start, min(start + size, iterations)) for r in row_counts for start in range(0, iterations, size)]
+
+_search_context = None
+
+def init_search(context):
+    # Worker process initializer: keep items and parameters instead of pickling them per task
+    global _search_context
+    _search_context = context
+
+def search_worker(task):
+    return search_candidates(_search_context, task)
+
+def search_candidates(context, task):
+    """
+    Score iterations [start, end) for one row count and return the best as (score, rows, iteration)
+    """
+    items = context["items"]
+    canvas_width = context["canvas_width"]
+    canvas_height = context["canvas_height"]
+    seed = context["seed"]
+    scoring = context["scoring"]
+    rows, start, end = task
+    if context["engine"] == "numpy":
+        # The vectorized area score pre-ranks; the best few are rescored exactly
+        keep = 1 if scoring == "area" else NUMPY_RESCORE
+        ranked = try_layout_numpy(items, canvas_width, canvas_height, rows, end, seed, start, keep)
+        if scoring != "area":
+            ranked = [(layout_score(build_candidate(context, rows, it)[0], canvas_width, canvas_height, context["angles"]), it)
+                      for _, it in ranked]
+        if not ranked:
+            return None
+        score, it = min(ranked)
+    else:
+        _, score, it = try_layout(items, canvas_width, canvas_height, rows, context["overlap_factor"], end, seed, start,
+                                  scoring, context["angles"])
+    if score is None:
+        return None
+    return score, rows, it
+
+def build_candidate(context, rows, it):
+    # Rebuild the full layout of a single candidate from its seed
+    items = context["items"]
+    seed = context["seed"]
+    order = None
+    if context["engine"] == "numpy":
+        order = numpy_permutations(seed, rows, it // NUMPY_BATCH, len(items))[it % NUMPY_BATCH]
+    return layout_candidate(items, context["canvas_width"], context["canvas_height"], rows, context["overlap_factor"],
+                            candidate_rng(seed, rows, it), order)
+
+def try_layout(items, canvas_width, canvas_height, rows, overlap_factor, iterations, seed=0, start=0,
+               scoring="area", angles=None):
     """
-    Test layout with given number of rows iteratively and return best found layout and score
+    Test layout with given number of rows iteratively and return best found layout, score and iteration
     """
     best_layout = None
     best_score = None  #  free area + overlap
-    for it in range(iterations):
-        layout = []
+    best_it = None
+    for it in range(start, iterations):
+        layout, score = layout_candidate(items, canvas_width, canvas_height, rows, overlap_factor,
+                                         candidate_rng(seed, rows, it))
+        if score is not None and scoring != "area":
+            score = layout_score(layout, canvas_width, canvas_height, angles)
+        if score is not None and (best_score is None or score < best_score):
+            best_score = score
+            best_layout = layout
+            best_it = it
+    return best_layout, best_score, best_it
+
+def numpy_permutations(seed, rows, batch, n):
+    # One batch of shuffles as an array of index permutations, reproducible per (rows, batch)
+    rng = np.random.default_rng(derive_seed(seed, "numpy", rows, batch))
+    return np.argsort(rng.random((NUMPY_BATCH, n)), axis=1)
+
+def try_layout_numpy(items, canvas_width, canvas_height, rows, iterations, seed=0, start=0, keep=1):
+    """
+    Vectorized try_layout: score shuffles in batches of array operations by free area and return
+    the best `keep` candidates of each batch as sorted (score, iteration) pairs.
+    Jitter does not change the free area, so it is left to layout_candidate for the winners.
+    """
+    n = len(items)
+    per_row = math.ceil(n/rows)
+    row_count = math.ceil(n/per_row)
+    pad = row_count*per_row - n
+    # Padding slots have width 0 and height 1, so they add neither height, width nor area
+    w = np.concatenate([np.array([item["w"] for item in items], dtype=np.float64), np.zeros(pad)])
+    h = np.concatenate([np.array([item["h"] for item in items], dtype=np.float64), np.ones(pad)])
+    h_max = np.concatenate([h[:n], np.zeros(pad)])
+    pad_index = np.arange(n, n + pad)
+
+    best = []
+    for batch in range(start // NUMPY_BATCH, math.ceil(iterations / NUMPY_BATCH)):
+        first = batch * NUMPY_BATCH
+        lo = max(start, first) - first
+        hi = min(iterations, first + NUMPY_BATCH) - first
+        perms = numpy_permutations(seed, rows, batch, n)[lo:hi]
+        perms = np.concatenate([perms, np.broadcast_to(pad_index, (len(perms), pad))], axis=1)
+        shape = (len(perms), row_count, per_row)
+
+        row_heights = h_max[perms].reshape(shape).max(axis=2)
+        scale_y = np.minimum(1.0, canvas_height / row_heights.sum(axis=1))
+        widths = w[perms].reshape(shape) * (row_heights[:, :, None] / h[perms].reshape(shape))
+        # cumsum adds sequentially like the Python engine, so floor() sees identical values
+        scale_x = np.minimum(1.0, canvas_width / np.cumsum(widths, axis=2)[:, :, -1])
+        scale = np.minimum(scale_x, scale_y[:, None])
+        w_scaled = np.floor(widths * scale[:, :, None])
+        h_scaled = np.floor(row_heights * scale)
+        used_area = (w_scaled * h_scaled[:, :, None]).sum(axis=(1, 2))
+        scores = canvas_width*canvas_height - used_area
+
+        top = np.argsort(scores, kind="stable")[:keep]
+        best += [(int(scores[i]), first + lo + int(i)) for i in top]
+    return sorted(best)
+
+def layout_candidate(items, canvas_width, canvas_height, rows, overlap_factor, rng, order=None):
+    """
+    Build one shuffled layout with the given number of rows and return it with its score.
+    A precomputed order (index permutation) replaces the shuffle.
+    """
+    layout = []
+    if order is None:
         shuffled = items.copy()
-        random.shuffle(shuffled)
-        per_row = math.ceil(len(shuffled)/rows)
-
-        # Calculate provisional height per row proportional to number of images
-        row_items = []
-        row_heights = []
-        for r in range(rows):
-            start = r*per_row
-            end = min((r+1)*per_row, len(shuffled))
-            row = shuffled[start:end]
-            if not row:
+        rng.shuffle(shuffled)
+    else:
+        shuffled = [items[i] for i in order]
+    per_row = math.ceil(len(shuffled)/rows)
+
+    # Calculate provisional height per row proportional to number of images
+    row_items = []
+    row_heights = []
+    for r in range(rows):
+        start = r*per_row
+        end = min((r+1)*per_row, len(shuffled))
+        row = shuffled[start:end]
+        if not row:
+            continue
+        row_items.append(row)
+        row_heights.append(max(item["h"] for item in row))
+
+    # Scaling to utilize canvas height
+    total_row_heights = sum(row_heights)
+    if total_row_heights == 0:
+        return None, None
+    scale_y = min(1.0, canvas_height / total_row_heights)
+    y = 0
+    for r, (rh, row) in enumerate(zip(row_heights, row_items)):
+        # Scale width per image within the row proportionally to row height
+        total_width = sum(item["w"] * (rh/item["h"]) for item in row)
+        scale_x = min(1.0, canvas_width / total_width)
+        scale = min(scale_x, scale_y)
+        x = 0
+        for item in row:
+            w_scaled = int(item["w"] * (rh/item["h"]) * scale)
+            h_scaled = int(rh * scale)
+            new_x, new_y = jitter(x, y, w_scaled, h_scaled, canvas_width, canvas_height, overlap_factor, rng)
+            layout.append({"item": item, "x": new_x, "y": new_y, "w": w_scaled, "h": h_scaled, "row": r})
+            x += w_scaled
+        y += int(rh * scale)
+
+    # Score: free area (exact coverage scoring is done by layout_score)
+    used_area = sum(l["w"]*l["h"] for l in layout)
+    free_area = canvas_width*canvas_height - used_area
+    return layout, free_area
+
+def jitter(x, y, w, h, canvas_width, canvas_height, overlap_factor, rng):
+    # Small shift within the overlap factor, kept on the canvas
+    shift_x = int((rng.random()-0.5) * overlap_factor * w)
+    shift_y = int((rng.random()-0.5) * overlap_factor * h)
+    return min(max(x + shift_x, 0), canvas_width - w), min(max(y + shift_y, 0), canvas_height - h)
+
+def partition_rows(aspects, rows):
+    """
+    Split a sequence of aspect ratios into contiguous rows whose aspect sums are as even as possible
+    (least squares linear partition). The cost is convex in the row sum, so the best split points are
+    monotone and a divide-and-conquer DP finds them in O(n*rows*log n). Returns the first index of each row.
+    """
+    n = len(aspects)
+    rows = max(1, min(rows, n))
+    prefix = [0.0]
+    for a in aspects:
+        prefix.append(prefix[-1] + a)
+    target = prefix[n] / rows
+
+    prev = [0.0] + [math.inf] * n
+    choices = []
+    for r in range(1, rows + 1):
+        cur = [math.inf] * (n + 1)
+        choice = [0] * (n + 1)
+        # (end range, split range) of row r ending at index end; rows are never empty
+        stack = [(r, n, r - 1, n - 1)]
+        while stack:
+            lo, hi, opt_lo, opt_hi = stack.pop()
+            if lo > hi:
+                continue
+            end = (lo + hi) // 2
+            best, best_i = math.inf, opt_lo
+            for i in range(opt_lo, min(end - 1, opt_hi) + 1):
+                d = prefix[end] - prefix[i] - target
+                cost = prev[i] + d*d
+                if cost < best:
+                    best, best_i = cost, i
+            cur[end], choice[end] = best, best_i
+            stack.append((lo, end - 1, opt_lo, best_i))
+            stack.append((end + 1, hi, best_i, opt_hi))
+        choices.append(choice)
+        prev = cur
+
+    starts = []
+    end = n
+    for r in range(rows, 0, -1):
+        end = choices[r - 1][end]
+        starts.append(end)
+    return starts[::-1]
+
+def justified_layout(items, canvas_width, canvas_height, rows, overlap_factor, seed=0):
+    """
+    Deterministic layout in a single pass: a seeded shuffle is split into rows of even aspect sums
+    (see partition_rows), every row is scaled to the full width and the block is scaled to fit the canvas.
+    Without a row count, the estimate and its neighbours are tried and the best fill wins.
+    Returns the jittered layout, its row count and the number of row counts tried.
+    """
+    n = len(items)
+    order = items.copy()
+    random.Random(derive_seed(seed, "justified")).shuffle(order)
+    aspects = [item["w"] / item["h"] for item in order]
+
+    if rows > 0:
+        row_counts = [min(rows, n)]
+    else:
+        # k rows with even aspect sums A/k are W*k/A high each, so k*k*W/A = H
+        estimate = max(1, round(math.sqrt(canvas_height * sum(aspects) / canvas_width)))
+        row_counts = [k for k in (estimate - 1, estimate, estimate + 1) if 1 <= k <= n]
+
+    best = None
+    for k in row_counts:
+        starts = partition_rows(aspects, k)
+        bounds = list(zip(starts, starts[1:] + [n]))
+        row_aspects = [sum(aspects[a:b]) for a, b in bounds]
+        height = sum(canvas_width / a for a in row_aspects)
+        fill = min(height / canvas_height, canvas_height / height)
+        if best is None or fill > best[0]:
+            best = (fill, k, bounds, row_aspects, height)
+    _, k, bounds, row_aspects, height = best
+
+    # Scale the block of full-width rows to fit and center it; edges are rounded so tiles meet without gaps
+    scale = min(1.0, canvas_height / height)
+    x0 = (canvas_width - canvas_width*scale) / 2
+    y = (canvas_height - height*scale) / 2
+    rng = random.Random(derive_seed(seed, "justified", "jitter"))
+    layout = []
+    for r, ((a, b), row_aspect) in enumerate(zip(bounds, row_aspects)):
+        row_height = canvas_width*scale / row_aspect
+        top, bottom = round(y), round(y + row_height)
+        x = x0
+        for item, aspect in zip(order[a:b], aspects[a:b]):
+            left, right = round(x), round(x + aspect*row_height)
+            w, h = max(1, right - left), max(1, bottom - top)
+            new_x, new_y = jitter(left, top, w, h, canvas_width, canvas_height, overlap_factor, rng)
+            layout.append({"item": item, "x": new_x, "y": new_y, "w": w, "h": h, "row": r})
+            x += aspect*row_height
+        y += row_height
+    return layout, k, len(row_counts)
+
+def rotation_angles(seed, count, max_rotation):
+    # Angles are drawn in layout order, so serial, parallel and scored rotations match
+    if max_rotation == 0:
+        return [None] * count
+    rng = random.Random(derive_seed(seed, "rotation"))
+    return [rng.uniform(-max_rotation, max_rotation) for _ in range(count)]
+
+def rotated_size(w, h, angle):
+    """
+    Size of Image.rotate(angle, expand=True), computed exactly like Pillow does
+    """
+    if angle is None or angle % 360 == 0:
+        return w, h
+    a = -math.radians(angle)
+    cos_a = round(math.cos(a), 15)
+    sin_a = round(math.sin(a), 15)
+    cx, cy = w / 2, h / 2
+    tx = cos_a * -cx + sin_a * -cy + cx
+    ty = -sin_a * -cx + cos_a * -cy + cy
+    xx = [cos_a * x + sin_a * y + tx for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    yy = [-sin_a * x + cos_a * y + ty for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    return math.ceil(max(xx)) - math.floor(min(xx)), math.ceil(max(yy)) - math.floor(min(yy))
+
+def tile_origin(l, w, h):
+    # Rotated tiles are larger than their layout box and centred on it
+    return l["x"] + (l["w"] - w) // 2, l["y"] + (l["h"] - h) // 2
+
+def tile_bounds(l, angle=None):
+    # Bounding box (x0, y0, x1, y1) of a tile as pasted by create_collage (may reach past the canvas edges)
+    w, h = rotated_size(l["w"], l["h"], angle)
+    x, y = tile_origin(l, w, h)
+    return x, y, x + w, y + h
+
+class CoverageTree:
+    """
+    Segment tree over sorted y coordinates. Each node keeps how often it is covered as a whole,
+    the covered length and the sums of c and c^2 over its range (c = covering count), so that
+    union length and pairwise overlap length are both available at the root in O(log n) per update.
+    """
+
+    def __init__(self, ys):
+        self.ys = ys
+        size = 4 * max(1, len(ys) - 1)
+        self.count = [0] * size
+        self.covered = [0] * size
+        self.sum1 = [0] * size
+        self.sum2 = [0] * size
+
+    def add(self, lo, hi, delta, node=1, left=0, right=None):
+        # Add delta to the coverage of the elementary segments [lo, hi)
+        if right is None:
+            right = len(self.ys) - 1
+        if hi <= left or right <= lo:
+            return
+        if lo <= left and right <= hi:
+            self.count[node] += delta
+        else:
+            mid = (left + right) // 2
+            self.add(lo, hi, delta, 2*node, left, mid)
+            self.add(lo, hi, delta, 2*node+1, mid, right)
+        self.pull(node, left, right)
+
+    def pull(self, node, left, right):
+        length = self.ys[right] - self.ys[left]
+        c = self.count[node]
+        if right - left > 1:
+            covered = self.covered[2*node] + self.covered[2*node+1]
+            sum1 = self.sum1[2*node] + self.sum1[2*node+1]
+            sum2 = self.sum2[2*node] + self.sum2[2*node+1]
+        else:
+            covered = sum1 = sum2 = 0
+        self.covered[node] = length if c > 0 else covered
+        self.sum1[node] = c*length + sum1
+        self.sum2[node] = c*c*length + 2*c*sum1 + sum2
+
+    def union_length(self):
+        return self.covered[1]
+
+    def pair_length(self):
+        # Sum over y of c*(c-1)/2, the number of overlapping pairs
+        return (self.sum2[1] - self.sum1[1]) // 2
+
+def coverage(rects, canvas_width, canvas_height):
+    """
+    Union area and summed pairwise overlap of rectangles clipped to the canvas,
+    by a sweep-line over x with a segment tree over y in O(n log n)
+    """
+    events = []
+    ys = set()
+    for x0, y0, x1, y1 in rects:
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, canvas_width), min(y1, canvas_height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        events.append((x0, 1, y0, y1))
+        events.append((x1, -1, y0, y1))
+        ys.update((y0, y1))
+    if not events:
+        return 0, 0
+
+    ys = sorted(ys)
+    index = {y: i for i, y in enumerate(ys)}
+    tree = CoverageTree(ys)
+    events.sort()
+    union = overlap = 0
+    prev_x = events[0][0]
+    for x, delta, y0, y1 in events:
+        if x != prev_x:
+            union += tree.union_length() * (x - prev_x)
+            overlap += tree.pair_length() * (x - prev_x)
+            prev_x = x
+        tree.add(index[y0], index[y1], delta)
+    return union, overlap
+
+def layout_score(layout, canvas_width, canvas_height, angles=None):
+    """
+    Uncovered canvas area plus summed pairwise overlap of all tiles (lower is better).
+    With angles, tiles are measured by their bounding boxes after rotation.
+    """
+    angles = angles or [None] * len(layout)
+    rects = [tile_bounds(l, angle) for l, angle in zip(layout, angles)]
+    union, overlap = coverage(rects, canvas_width, canvas_height)
+    return canvas_width*canvas_height - union + overlap
+
+def render_tile(item, w, h, angle=None, cache=None, resample=DEFAULT_RESAMPLE):
+    """
+    Decode, resize and optionally rotate a single tile
+    """
+    return render_tiles(item, [(w, h)], angle, cache, resample)[0]
+
+def render_tiles(item, sizes, angle=None, cache=None, resample=DEFAULT_RESAMPLE):
+    """
+    Render one tile per output size from a single decode: the largest size is decoded (reduced)
+    from the source or cache, smaller sizes are resized from successively halved copies of it
+    """
+    level = open_image(item, (max(w for w, _ in sizes), max(h for _, h in sizes)), cache)
+    tiles = {}
+    for w, h in sorted(set(sizes), reverse=True):
+        while level.width // 2 >= w and level.height // 2 >= h:
+            level = level.reduce(2)
+        tiles[(w, h)] = transform_tile(level, w, h, angle, resample)
+    del level  # release the decoded source right away (cached levels stay alive in their cache)
+    return [tiles[size] for size in sizes]
+
+def tile_transform(src_w, src_h, w, h, angle):
+    """
+    Size of the rotated tile and the affine coefficients that map its pixels back into a
+    src_w x src_h source: rotation about the centre (like Image.rotate with expand) and scaling in one
+    """
+    out_w, out_h = rotated_size(w, h, angle)
+    a = -math.radians(angle)
+    cos_a, sin_a = round(math.cos(a), 15), round(math.sin(a), 15)
+    sx, sy = src_w / w, src_h / h
+    return (out_w, out_h), (cos_a*sx, sin_a*sx, sx*(w/2 - cos_a*out_w/2 - sin_a*out_h/2),
+                            -sin_a*sy, cos_a*sy, sy*(h/2 + sin_a*out_w/2 - cos_a*out_h/2))
+
+def transform_tile(img, w, h, angle=None, resample=DEFAULT_RESAMPLE):
+    """
+    Resize img to w x h and rotate it by angle (expanded, transparent corners). Except for "lanczos",
+    a rotated tile is sampled from img by a single affine transform, without an intermediate resized copy.
+    """
+    resample = RESAMPLE_FILTERS[resample]
+    factor = min(img.width // w, img.height // h)
+    if factor > 1:
+        # The transform does not filter when scaling down: box-reduce to less than twice the size first
+        img = img.reduce(factor)
+    if angle is None:
+        return img.resize((w, h), resample)
+    if resample == Image.LANCZOS:
+        img = img.resize((w, h), Image.LANCZOS)
+        resample = Image.NEAREST  # what Image.rotate uses; a smoother filter would cost more than the resize
+    size, data = tile_transform(img.width, img.height, w, h, angle)
+    return img.transform(size, Image.AFFINE, data, resample)
+
+def render_tile_buffers(job):
+    # Worker process entry point: return the tiles as raw RGBA buffers
+    return [(img.size, img.tobytes()) for img in render_tiles(*job)]
+
+def tile_memory(item, sizes, angle=None):
+    # Rough peak bytes to decode (reduced), resize and rotate the tiles of one image as RGBA
+    w, h = max(w for w, _ in sizes), max(h for _, h in sizes)
+    factor = max(1, min(item["w"] // max(1, w), item["h"] // max(1, h)))
+    decoded = math.ceil(item["w"] / factor) * math.ceil(item["h"] / factor)
+    for w, h in sizes:
+        w_rot, h_rot = rotated_size(w, h, angle)
+        decoded += w*h + w_rot*h_rot
+    return decoded * 4
+
+def parse_sizes(spec):
+    """
+    Parse additional output sizes like "1280,320" (widths, height None) or "1280x720"
+    """
+    sizes = []
+    for part in spec.split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if "x" in part:
+            w, h = (int(v) for v in part.split("x"))
+        else:
+            w, h = int(part), None
+        sizes.append((w, h))
+    return sizes
+
+def output_sizes(sizes, width, height):
+    """
+    Additional output sizes as (w, h); a missing height keeps the aspect ratio of the width x height canvas.
+    The layout is scaled, not laid out again, so a size with another aspect ratio would distort the photos.
+    """
+    result = []
+    for w, h in sizes or []:
+        w, exact = int(w), int(w) * height / width
+        if h and abs(int(h) - exact) > 1:
+            raise ValueError(f"Output size {w}x{h} does not have the aspect ratio of the {width}x{height} canvas "
+                             f"(use {w}x{max(1, round(exact))} or the width {w} only).")
+        result.append((w, int(h) if h else max(1, round(exact))))
+    return result
+
+def sized_output(output, w, h):
+    # collage.png -> collage_1280x720.png
+    base, ext = os.path.splitext(output)
+    return f"{base}_{w}x{h}{ext}"
+
+def scale_layout(layout, scale_x, scale_y):
+    # The layout in coordinates of a canvas scaled by (scale_x, scale_y)
+    return [{**l, "x": round(l["x"]*scale_x), "y": round(l["y"]*scale_y),
+             "w": max(1, round(l["w"]*scale_x)), "h": max(1, round(l["h"]*scale_y))} for l in layout]
+
+def new_canvas(width, height, bgcolor):
+    if bgcolor == "transparent":
+        return Image.new("RGBA", (width, height), (0,0,0,0))
+    return Image.new("RGB", (width, height), bgcolor)
+
+def map_bounded(pool, fn, jobs, costs, budget=None):
+    """
+    Like pool.map, but only submits jobs while the estimated memory of results that are
+    in flight or not yet consumed stays within budget (at least one job is always in flight)
+    """
+    queue = deque()
+    used = 0
+    for job, cost in zip(jobs, costs):
+        while queue and budget is not None and used + cost > budget:
+            future, done_cost = queue.popleft()
+            used -= done_cost
+            yield future.result()
+        queue.append((pool.submit(fn, job), cost))
+        used += cost
+    while queue:
+        yield queue.popleft()[0].result()
+
+def peak_rss():
+    """
+    Peak resident memory in bytes of this process and of its largest finished child process
+    (e.g. pool workers), or None where the platform does not report it
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+def cpu_times():
+    # CPU seconds of this process and of its finished child processes (pool workers)
+    own = time.process_time()
+    if resource is None:
+        return own, 0.0
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children.ru_utime + children.ru_stime
+
+@contextmanager
+def measure_stage(metrics, name):
+    """
+    Record wall time, CPU time (own and workers) and peak memory of a stage into metrics["stages"].
+    Peak memory is the high-water mark at the end of the stage. Nothing is measured if metrics is None.
+    """
+    if metrics is None:
+        yield
+        return
+    wall = time.perf_counter()
+    cpu, cpu_workers = cpu_times()
+    try:
+        yield
+    finally:
+        cpu_end, cpu_workers_end = cpu_times()
+        stage = {"wall": time.perf_counter() - wall, "cpu": cpu_end - cpu, "cpu_workers": cpu_workers_end - cpu_workers}
+        rss = peak_rss()
+        if rss is not None:
+            stage["peak_rss"], stage["peak_rss_workers"] = rss
+        metrics.setdefault("stages", {})[name] = stage
+
+def print_metrics(metrics):
+    print(f"{'Stage':<8} {'Wall':>9} {'CPU':>9} {'Workers':>9} {'Peak MB':>8}")
+    for name, stage in metrics.get("stages", {}).items():
+        peak = f"{stage['peak_rss'] / 2**20:.0f}" if "peak_rss" in stage else "-"
+        print(f"{name:<8} {stage['wall']:>8.3f}s {stage['cpu']:>8.3f}s {stage['cpu_workers']:>8.3f}s {peak:>8}")
+    counters = metrics.get("counters", {})
+    if counters:
+        print(", ".join(f"{key}: {value}" for key, value in counters.items()))
+
+def write_metrics(metrics, path):
+    with open(path, "w") as f:
+        json.dump(metrics, f, indent=4)
+
+def output_format(output, fmt=None):
+    """
+    Pillow format name for the output: fmt if given, otherwise from the file extension
+    """
+    if fmt:
+        fmt = fmt.upper().replace("JPG", "JPEG")
+        if fmt not in OUTPUT_FORMATS.values():
+            raise ValueError(f"Unsupported output format: {fmt}. Use PNG, JPEG or WebP.")
+        return fmt
+    ext = os.path.splitext(output)[1].lower()
+    if ext not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output file extension: {ext or '(none)'}. "
+                         f"Use {', '.join(OUTPUT_FORMATS)} or give the format.")
+    return OUTPUT_FORMATS[ext]
+
+def encoder_options(fmt, transparent, quality=None, compress_level=None, lossless=False):
+    """
+    Pillow save() options for the output format
+    """
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError(f"Quality must be between 1 and 100, not {quality}.")
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise ValueError(f"Compression level must be between 0 and 9, not {compress_level}.")
+    if fmt == "PNG":
+        # zlib level 0-9: lower is faster and larger (Pillow's default is 6)
+        return {"compress_level": 6 if compress_level is None else compress_level}
+    if fmt == "JPEG":
+        if transparent:
+            raise ValueError("JPEG does not support a transparent background. Use PNG or WebP.")
+        return {"quality": DEFAULT_QUALITY if quality is None else quality, "optimize": True}
+    if fmt == "WEBP":
+        # method 0-6 trades encoding speed for size, mapped from the compression level
+        method = 4 if compress_level is None else min(6, round(compress_level * 6 / 9))
+        if lossless:
+            return {"lossless": True, "quality": 100 if quality is None else quality, "method": method}
+        return {"quality": DEFAULT_QUALITY if quality is None else quality, "method": method}
+    raise ValueError(f"Unsupported output format: {fmt}")
+
+_encoder = None
+_pending_saves = []
+_pending_lock = threading.Lock()
+
+def save_image(img, output, fmt, options, background=False):
+    """
+    Encode and write the collage. In the background, encoding runs on a separate thread
+    (Pillow releases the GIL while encoding), so the caller can start on the next collage;
+    the future of the write is returned, and wait_for_saves() waits for all pending writes.
+    """
+    def save():
+        # Write a temporary file and rename it, so readers never see a partially written collage
+        tmp = temp_path(output)
+        try:
+            img.save(tmp, fmt, **options)
+            os.replace(tmp, output)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        print(f"Collage saved: {output}")
+        return output
+
+    if not background:
+        return save()
+
+    global _encoder
+    with _pending_lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collage-encoder")
+        future = _encoder.submit(save)
+        _pending_saves.append(future)
+    return future
+
+def wait_for_saves(futures=None):
+    # Wait for background saves (all pending ones, or just the given futures); re-raises the first encoding error
+    with _pending_lock:
+        pending = list(_pending_saves) if futures is None else list(futures)
+        _pending_saves[:] = [f for f in _pending_saves if f not in pending]
+    errors = [f.exception() for f in pending]
+    errors = [e for e in errors if e is not None]
+    if errors:
+        raise errors[0]
+
+def resolve_workers(workers):
+    # 0 = one worker per CPU core
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def serialize_layout(layout):
+    # Layout without image records, for storing as JSON
+    return [{"name": l["item"]["name"], "x": l["x"], "y": l["y"], "w": l["w"], "h": l["h"], "row": l.get("row")}
+            for l in layout]
+
+def restore_layout(entries, items):
+    # Reattach image records by name; None if an image is missing
+    by_name = {item["name"]: item for item in items}
+    if any(e["name"] not in by_name for e in entries):
+        return None
+    return [{"item": by_name[e["name"]], "x": e["x"], "y": e["y"], "w": e["w"], "h": e["h"], "row": e.get("row")}
+            for e in entries]
+
+def state_path(output):
+    # Layout state of an output for incremental updates: collage.png -> collage.png.layout.json
+    return output + ".layout.json"
+
+def load_state(output):
+    try:
+        with open(state_path(output), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_state(output, layout, angles, params):
+    tiles = [{**entry, "angle": angle} for entry, angle in zip(serialize_layout(layout), angles)]
+    path = state_path(output)
+    tmp = temp_path(path)
+    with open(tmp, "w") as f:
+        json.dump({"params": params, "tiles": tiles}, f)
+    os.replace(tmp, path)
+
+def write_manifest(path, input_dir, layout, angles, width, height, seed):
+    """
+    Save a layout with everything needed to render it again: image names and header data,
+    tile positions, sizes and angles, canvas size and seed
+    """
+    tiles = [{**entry, "angle": angle, "image": [l["item"]["w"], l["item"]["h"], l["item"].get("orientation", 1)]}
+             for entry, l, angle in zip(serialize_layout(layout), layout, angles)]
+    manifest = {"input_dir": os.path.abspath(input_dir), "width": width, "height": height, "seed": seed, "tiles": tiles}
+    tmp = temp_path(path)
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp, path)
+    print(f"Layout saved: {path}")
+
+def read_manifest(path, input_dir=None, cache=None):
+    """
+    Layout and angles of a manifest written by write_manifest. Images are taken from input_dir if given
+    (e.g. a moved folder), else from the manifest's folder; their headers are not read again.
+    """
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    input_dir = input_dir or manifest["input_dir"]
+    layout, angles, missing = [], [], []
+    for tile in manifest["tiles"]:
+        item_path = os.path.join(input_dir, tile["name"])
+        w, h, orientation = tile["image"]
+        item = {"name": tile["name"], "path": item_path, "w": w, "h": h, "orientation": orientation}
+        if cache is not None:
+            try:
+                item["key"] = cache.key_for(item_path)
+            except OSError:
+                missing.append(tile["name"])
                 continue
-            row_items.append(row)
-            row_heights.append(max(item["h"] for item in row))
+        elif not os.path.exists(item_path):
+            missing.append(tile["name"])
+            continue
+        layout.append({"item": item, "x": tile["x"], "y": tile["y"], "w": tile["w"], "h": tile["h"],
+                       "row": tile.get("row")})
+        angles.append(tile["angle"])
+    if missing:
+        raise ValueError(f"{len(missing)} images of the layout are missing in {input_dir}, e.g. {missing[0]}")
+    return manifest, layout, angles
+
+def tile_angle(seed, name, max_rotation):
+    # Angle of a tile added by an incremental update, independent of its position in the layout
+    if max_rotation == 0:
+        return None
+    return random.Random(derive_seed(seed, "rotation", name)).uniform(-max_rotation, max_rotation)
 
-        # Scaling to utilize canvas height
-        total_row_heights = sum(row_heights)
-        if total_row_heights == 0:
+def reflow_layout(tiles, items, canvas_width, canvas_height, overlap_factor, seed, max_rotation):
+    """
+    Update a previous layout (state tiles with row and angle) for added and removed images. Only rows
+    that lost images or receive new ones are laid out again within their old band; all other tiles keep
+    their place and angle. New images go to the rows with the smallest aspect sum (the most room).
+    Returns the layout, its angles and the regions (x0, y0, x1, y1) that changed, or None if the
+    previous layout cannot be reused or too much has changed.
+    """
+    by_name = {item["name"]: item for item in items}
+    known = {t["name"] for t in tiles}
+    added = [item for item in items if item["name"] not in known]
+    removed = [t for t in tiles if t["name"] not in by_name]
+    if not tiles or any(t.get("row") is None for t in tiles):
+        return None
+    if len(added) + len(removed) > INCREMENTAL_MAX_CHANGE * len(tiles):
+        return None
+
+    rows = {}
+    for t in tiles:
+        rows.setdefault(t["row"], []).append(t)
+    contents = {r: [by_name[t["name"]] for t in row if t["name"] in by_name] for r, row in rows.items()}
+    dirty = {t["row"] for t in removed}
+    for item in added:
+        r = min(rows, key=lambda r: (sum(i["w"] / i["h"] for i in contents[r]), r))
+        contents[r].append(item)
+        dirty.add(r)
+
+    layout = []
+    angles = []
+    regions = []
+    for r in sorted(rows):
+        old = rows[r]
+        if r not in dirty:
+            layout += [{"item": by_name[t["name"]], "x": t["x"], "y": t["y"], "w": t["w"], "h": t["h"], "row": r} for t in old]
+            angles += [t["angle"] for t in old]
             continue
-        scale_y = min(1.0, canvas_height / total_row_heights)
-        y = 0
-        for rh, row in zip(row_heights, row_items):
-            # Scale width per image within the row proportionally to row height
-            total_width = sum(item["w"] * (rh/item["h"]) for item in row)
-            scale_x = min(1.0, canvas_width / total_width)
-            scale = min(scale_x, scale_y)
-            x = 0
-            for item in row:
-                w_scaled = int(item["w"] * (rh/item["h"]) * scale)
-                h_scaled = int(rh * scale)
-                # small shift within overlap factor
-                shift_x = int((random.random()-0.5) * overlap_factor * w_scaled)
-                shift_y = int((random.random()-0.5) * overlap_factor * h_scaled)
-                new_x = min(max(x + shift_x, 0), canvas_width - w_scaled)
-                new_y = min(max(y + shift_y, 0), canvas_height - h_scaled)
-                layout.append({"img": item["img"], "x": new_x, "y": new_y, "w": w_scaled, "h": h_scaled})
-                x += w_scaled
-            y += int(rh * scale)
-
-        # Score: free area + overlap between rows
-        used_area = sum(l["w"]*l["h"] for l in layout)
-        free_area = canvas_width*canvas_height - used_area
-        score = free_area
-        if best_score is None or score < best_score:
-            best_score = score
-            best_layout = layout
-    return best_layout, best_score
+        # The row keeps its band: old top and tile height, left aligned where it started
+        top = min(t["y"] for t in old)
+        band = max(t["h"] for t in old)
+        widths = [item["w"] * band / item["h"] for item in contents[r]]
+        scale = min(1.0, canvas_width / sum(widths)) if widths else 1.0
+        h = max(1, int(band * scale))
+        y = top + (band - h) // 2
+        x = min(min(t["x"] for t in old), max(0, int(canvas_width - sum(widths) * scale)))
+        rng = random.Random(derive_seed(seed, "reflow", r))
+        old_angles = {t["name"]: t["angle"] for t in old}
+        new = []
+        for item, width in zip(contents[r], widths):
+            w = max(1, int(width * scale))
+            new_x, new_y = jitter(x, y, w, h, canvas_width, canvas_height, overlap_factor, rng)
+            new.append({"item": item, "x": new_x, "y": new_y, "w": w, "h": h, "row": r})
+            angles.append(old_angles[item["name"]] if item["name"] in old_angles else
+                          tile_angle(seed, item["name"], max_rotation))
+            x += w
+        layout += new
+        # Everything the row covered before or covers now
+        bounds = [tile_bounds(t, t["angle"]) for t in old]
+        bounds += [tile_bounds(l, a) for l, a in zip(new, angles[len(layout)-len(new):])]
+        regions.append((max(0, min(b[0] for b in bounds)), max(0, min(b[1] for b in bounds)),
+                        min(canvas_width, max(b[2] for b in bounds)), min(canvas_height, max(b[3] for b in bounds))))
+    print(f"Incremental update: {len(added)} added, {len(removed)} removed, {len(dirty)} of {len(rows)} rows laid out again")
+    return layout, angles, regions
+
+def render_regions(canvas, layout, angles, regions, bgcolor, cache=None, resample=DEFAULT_RESAMPLE):
+    """
+    Repaint regions (x0, y0, x1, y1) of an existing canvas from scratch: every tile that touches a region
+    is pasted again in layout order, so each region ends up exactly as in a full render
+    """
+    bounds = [tile_bounds(l, angle) for l, angle in zip(layout, angles)]
+    tiles = {}
+    for x0, y0, x1, y1 in regions:
+        region = new_canvas(x1 - x0, y1 - y0, bgcolor)
+        for i, (bx0, by0, bx1, by1) in enumerate(bounds):
+            if bx0 < x1 and bx1 > x0 and by0 < y1 and by1 > y0:
+                if i not in tiles:
+                    tiles[i] = render_tile(layout[i]["item"], layout[i]["w"], layout[i]["h"], angles[i], cache,
+                                           resample)
+                region.paste(tiles[i], (bx0 - x0, by0 - y0), tiles[i])
+        canvas.paste(region, (x0, y0))
+
+def update_collage(state, items, width, height, bgcolor, output, fmt, options, cache=None):
+    """
+    Incremental update of an existing output from its layout state. Returns the new layout and angles,
+    or None if it has to be rendered in full.
+    """
+    params = state["params"]
+    result = reflow_layout(state["tiles"], items, width, height, params["overlap_factor"], params["seed"],
+                           params["max_rotation"])
+    if result is None:
+        return None
+    layout, angles, regions = result
+    if regions:
+        with Image.open(output) as img:
+            canvas = img.convert("RGBA" if bgcolor == "transparent" else "RGB")
+        render_regions(canvas, layout, angles, regions, bgcolor, cache, params["resample"])
+        save_image(canvas, output, fmt, options)
+    store_state(output, layout, angles, params)
+    return layout, angles
+
+def plan_layout(items, width, height, rows, overlap_factor, iterations, seed, workers, engine, row_search, scoring,
+                max_rotation, cache=None, layout=None, stats=None, profile=None, progress=None, cancel=None,
+                layout_mode="organic"):
+    """
+    The given layout, else the cached layout for these items and parameters, else a newly computed one
+    """
+    if layout is None and cache is not None:
+        # Identical inputs (in the same order) and parameters give the identical layout
+        layout_key = cache.key_for_data({
+            "items": [[item["key"], item["name"]] for item in items],
+            "params": [width, height, rows, overlap_factor, iterations, seed, resolve_engine(engine), row_search,
+                       scoring, max_rotation, layout_mode],
+        })
+        entries = cache.load_layout(layout_key)
+        if entries is not None:
+            layout = restore_layout(entries, items)
+            if layout is not None:
+                print("Layout: loaded from cache")
+
+    if layout is None:
+        stats = {} if stats is None else stats
+        profiler = cProfile.Profile() if profile else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            layout = compute_layout(items, width, height, rows, overlap_factor, iterations, seed, workers, engine,
+                                    row_search, stats, scoring, max_rotation, progress, cancel, layout_mode)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile)
+        print(f"Layout: {stats['rows']} rows, {stats['candidates']} candidates evaluated over {stats['row_counts']} row counts")
+        if cache is not None:
+            cache.store_layout(layout_key, serialize_layout(layout))
+
+    return layout
+
+def create_collage(input_dir, width, height, bgcolor, output, max_rotation=5, overlap_factor=0.05, rows=0, iterations=15, workers=1, seed=None, engine="auto", row_search="pruned", scoring="coverage", cache=None, strip_height=0,
+                   max_memory=None, fmt=None, quality=None, compress_level=None, lossless=False, background_save=False,
+                   items=None, sizes=None, progress=None, cancel=None, layout=None, metrics=None, profile=None,
+                   recursive=False, include=None, exclude=None, max_files=None, max_images=None, tile_size=None,
+                   stratify=None, layout_mode="organic", incremental=False, resample=DEFAULT_RESAMPLE, save_layout=None,
+                   from_layout=None, saves=None):
+    """
+    Create a collage from the images in input_dir and save it to output.
+    progress(stage, done, total) is called for the stages "loading", "layout", "render" and "save"
+    (total is None when unknown); if cancel() returns True, CollageCancelled is raised.
+    A layout computed beforehand for the same items and seed (e.g. by a preview) skips the layout search.
+    With a metrics dict, per-stage timings (see measure_stage) and counters are recorded into it;
+    with a profile path, the layout search of this process is profiled and the cProfile stats written there.
+    recursive, include, exclude and max_files select the input files (see walk_images). If the folder has
+    more than max_images images, or more than tiles of about tile_size pixels fit the canvas, a sample is used.
+    With incremental, the layout state is kept next to the output and a later run with the same parameters
+    only lays out and repaints the rows affected by added or removed images (see reflow_layout).
+    resample selects the filter for resizing and rotating tiles (see RESAMPLE_FILTERS; "lanczos" by default).
+    sizes are additional outputs (w, h) with the aspect ratio of the canvas; with h None, the height follows it.
+    With save_layout, the layout is also written as a manifest to that path. With from_layout, such a manifest
+    is rendered (canvas size and seed from the manifest, input_dir may be None): no scan and no layout search.
+    With background_save, the futures of the pending writes are appended to the saves list, if given.
+    """
+    # Check the output format and encoder settings before scanning, so a typo does not cost a whole run
+    fmt = output_format(output, fmt)
+    options = encoder_options(fmt, bgcolor == "transparent", quality, compress_level, lossless)
+    if resample not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resampling filter: {resample}")
+
+    if layout is not None and seed is None:
+        raise ValueError("A given layout needs the seed it was computed with.")
+
+    angles = None
+    if from_layout is not None:
+        if incremental:
+            raise ValueError("A saved layout cannot be updated incrementally.")
+        with measure_stage(metrics, "load"):
+            manifest, layout, angles = read_manifest(from_layout, input_dir, cache)
+        input_dir = input_dir or manifest["input_dir"]
+        width, height, seed = manifest["width"], manifest["height"], manifest["seed"]
+        items = [l["item"] for l in layout]
+    sizes = output_sizes(sizes, width, height)
 
-def create_collage(input_dir, width, height, bgcolor, output, max_rotation=5, overlap_factor=0.05, rows=0, iterations=15):
-    items = load_images(input_dir)
+    state = None
+    if incremental:
+        if sizes or strip_height > 0 or max_memory is not None:
+            raise ValueError("Incremental updates render a single output on a full canvas.")
+        state = load_state(output) if os.path.exists(output) else None
+        if state is not None and seed is None:
+            seed = state["params"]["seed"]
+
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+        print(f"Seed: {seed}")
+
+    if items is None:
+        with measure_stage(metrics, "load"):
+            items = load_images(input_dir, cache, progress, cancel, recursive, include, exclude, max_files,
+                                max_images=image_limit(width, height, max_images, tile_size), stratify=stratify,
+                                seed=seed, max_memory=max_memory)
 
     if not items:
         return None
-    
-    layout = compute_layout(items, width, height, rows, overlap_factor, iterations)
 
-    if bgcolor == "transparent":
-        canvas = Image.new("RGBA", (width, height), (0,0,0,0))
+    params = {"width": width, "height": height, "seed": seed, "bgcolor": bgcolor if bgcolor == "transparent" else list(bgcolor),
+              "overlap_factor": overlap_factor, "max_rotation": max_rotation, "layout_mode": layout_mode,
+              "resample": resample}
+    if state is not None and state.get("params") == params:
+        with measure_stage(metrics, "render"):
+            updated = update_collage(state, items, width, height, bgcolor, output, fmt, options, cache)
+        if updated is not None:
+            if save_layout:
+                write_manifest(save_layout, input_dir, *updated, width, height, seed)
+            return output
+
+    stats = {}
+    layout_started = time.perf_counter()
+    with measure_stage(metrics, "layout"):
+        layout = plan_layout(items, width, height, rows, overlap_factor, iterations, seed, workers, engine, row_search,
+                             scoring, max_rotation, cache, layout, stats, profile, progress, cancel, layout_mode)
+    layout_seconds = time.perf_counter() - layout_started
+
+    if metrics is not None:
+        metrics["counters"] = {"images": len(items), "tiles": len(layout), "outputs": 1 + len(sizes or []),
+                               "rows": stats.get("rows"), "candidates": stats.get("candidates", 0),
+                               "row_counts": stats.get("row_counts", 0),
+                               "candidates_per_second": round(stats.get("candidates", 0) / max(layout_seconds, 1e-9))}
+
+    if angles is None:
+        angles = rotation_angles(seed, len(layout), max_rotation)
+    if save_layout:
+        write_manifest(save_layout, input_dir, layout, angles, width, height, seed)
+    workers = resolve_workers(workers)
+
+    # The master canvas and any additional sizes, all rendered from the same layout
+    targets = [(width, height, layout, output)]
+    for w, h in sizes:
+        targets.append((w, h, scale_layout(layout, w / width, h / height), sized_output(output, w, h)))
+
+    channels = 4 if bgcolor == "transparent" else 3
+    canvas_bytes = sum(w*h*channels for w, h, _, _ in targets)
+    if max_memory is not None and strip_height <= 0 and canvas_bytes > max_memory // 2:
+        # The canvas alone would take most of the budget: render in bands instead
+        if fmt != "PNG" or len(targets) > 1:
+            raise ValueError("The canvas does not fit into the memory budget. Use a single PNG output for strip rendering.")
+        strip_height = max(1, (max_memory // 4) // (width*channels))
+        print(f"Canvas exceeds the memory budget, rendering in strips of {strip_height} rows")
+
+    if strip_height > 0:
+        if fmt != "PNG" or len(targets) > 1:
+            raise ValueError("Strip rendering writes a single PNG output only.")
+        # Bands are encoded as they are rendered, so this stage includes saving
+        with measure_stage(metrics, "render"):
+            render_strips(layout, angles, width, height, bgcolor, output, strip_height, workers, cache, max_memory,
+                          options["compress_level"], progress, cancel, resample)
+        print(f"Collage saved: {output}")
     else:
-        canvas = Image.new("RGB", (width, height), bgcolor)
-
-    for l in layout:
-        img = l["img"].resize((l["w"], l["h"]), Image.LANCZOS)
-
-        # optional rotation
-        if max_rotation != 0:
-            angle = random.uniform(-max_rotation, max_rotation)
-            img = img.rotate(angle, expand=True)
-            w_rot, h_rot = img.size
-            new_x = min(max(l["x"], 0), width - w_rot)
-            new_y = min(max(l["y"], 0), height - h_rot)
-        else:
-            new_x = l["x"]
-            new_y = l["y"]
+        with measure_stage(metrics, "render"):
+            canvases = [new_canvas(w, h, bgcolor) for w, h, _, _ in targets]
+            jobs = [(l["item"], [(t[2][i]["w"], t[2][i]["h"]) for t in targets], angle, cache, resample)
+                    for i, (l, angle) in enumerate(zip(layout, angles))]
+            if workers > 1:
+                budget = None if max_memory is None else max_memory - canvas_bytes
+                with process_pool(workers) as pool:
+                    results = map_bounded(pool, render_tile_buffers, jobs, [tile_memory(*job[:3]) for job in jobs], budget)
+                    tile_sets = ([Image.frombytes("RGBA", size, data) for size, data in buffers] for buffers in results)
+                    paste_tile_sets(canvases, targets, tile_sets, progress, cancel)
+            else:
+                tile_sets = (render_tiles(*job) for job in jobs)
+                paste_tile_sets(canvases, targets, tile_sets, progress, cancel)
+
+        # With background_save this only covers handing the canvases to the encoder thread
+        with measure_stage(metrics, "save"):
+            for i, (canvas, (_, _, _, path)) in enumerate(zip(canvases, targets)):
+                report(progress, cancel, "save", i, len(targets))
+                pending = save_image(canvas, path, fmt, options, background_save)
+                if background_save and saves is not None:
+                    saves.append(pending)
+            report(progress, None, "save", len(targets), len(targets))
+
+    if incremental:
+        store_state(output, layout, angles, params)
 
-        canvas.paste(img, (new_x, new_y), img)
+    if cache is not None:
+        cache.evict()
 
-    canvas.save(output)
-    print(f"Collage saved: {output}")
+    rss = peak_rss()
+    if rss is not None:
+        workers_rss = f" (largest worker: {rss[1] / 2**20:.0f} MB)" if workers > 1 else ""
+        print(f"Peak memory: {rss[0] / 2**20:.0f} MB{workers_rss}")
     
     return output
 
+def render_strips(layout, angles, width, height, bgcolor, output, strip_height, workers=1, cache=None, max_memory=None,
+                  compress_level=6, progress=None, cancel=None, resample=DEFAULT_RESAMPLE):
+    """
+    Composite the canvas in horizontal bands and stream each band into a PNG encoder.
+    Tiles are decoded when the first band reaches them and released after the last,
+    so peak memory follows the band height rather than the canvas size.
+    """
+    if bgcolor == "transparent":
+        mode, fill = "RGBA", (0,0,0,0)
+    else:
+        mode, fill = "RGB", bgcolor
+
+    bounds = [tile_bounds(l, angle) for l, angle in zip(layout, angles)]
+    pending = sorted(range(len(layout)), key=lambda i: bounds[i][1])
+    next_pending = 0
+    active = {}
+
+    with process_pool(workers) if workers > 1 else nullcontext() as pool:
+        with PngStreamWriter(output, width, height, mode, compress_level) as writer:
+            for top in range(0, height, strip_height):
+                # Render and encoding are one step per band
+                report(progress, cancel, "render", top, height)
+                bottom = min(top + strip_height, height)
+
+                # Decode the tiles that start in this band
+                starting = []
+                while next_pending < len(pending) and bounds[pending[next_pending]][1] < bottom:
+                    starting.append(pending[next_pending])
+                    next_pending += 1
+                jobs = [(layout[i]["item"], [(layout[i]["w"], layout[i]["h"])], angles[i], cache, resample)
+                        for i in starting]
+                if pool is not None and len(jobs) > 1:
+                    budget = None if max_memory is None else max_memory - width*strip_height*4
+                    results = map_bounded(pool, render_tile_buffers, jobs, [tile_memory(*job[:3]) for job in jobs], budget)
+                    tiles = (Image.frombytes("RGBA", *buffers[0]) for buffers in results)
+                else:
+                    tiles = (render_tiles(*job)[0] for job in jobs)
+                active.update(zip(starting, tiles))
+
+                # Paste in layout order, as on the full canvas
+                band = Image.new(mode, (width, bottom - top), fill)
+                for i in sorted(active):
+                    band.paste(active[i], (bounds[i][0], bounds[i][1] - top), active[i])
+                writer.write(band)
+
+                for i in [i for i in active if bounds[i][3] <= bottom]:
+                    del active[i]
+            report(progress, None, "render", height, height)
+
+def paste_tile_sets(canvases, targets, tile_sets, progress=None, cancel=None):
+    # Paste the tiles of each image into every output canvas, in layout order
+    count = len(targets[0][2])
+    report(progress, cancel, "render", 0, count)
+    for i, tiles in enumerate(tile_sets):
+        for canvas, (_, _, layout, _), img in zip(canvases, targets, tiles):
+            paste_tile(canvas, layout[i], img)
+        report(progress, cancel, "render", i + 1, count)
+
+def paste_tile(canvas, l, img):
+    # Rotated tiles are centred on their layout box; parts past the canvas edges are cut off
+    canvas.paste(img, tile_origin(l, *img.size), img if img.mode == "RGBA" else None)
+
+def load_thumbnails(items, max_side=None, progress=None, cancel=None):
+    """
+    Decode small upright thumbnails for previews (reduced decoding, no cache), keyed by path.
+    By default they are about twice the size of an average preview tile.
+    """
+    if max_side is None:
+        max_side = min(PREVIEW_THUMB_SIDE, max(64, round(2 * PREVIEW_SIDE / math.sqrt(max(1, len(items))))))
+    thumbs = {}
+    for i, item in enumerate(items):
+        report(progress, cancel, "loading", i, len(items))
+        scale = min(1, max_side / max(item["w"], item["h"]))
+        size = (max(1, round(item["w"]*scale)), max(1, round(item["h"]*scale)))
+        img = open_image(item, size)
+        if img.size != size:
+            img = img.resize(size, Image.BILINEAR)
+        if img.getchannel("A").getextrema() == (255, 255):
+            # Opaque: RGB resizes about twice as fast as RGBA (no premultiplying)
+            img = img.convert("RGB")
+        thumbs[item["path"]] = img
+    report(progress, cancel, "loading", len(items), len(items))
+    return thumbs
+
+def render_preview(layout, angles, thumbs, width, height, bgcolor, max_side=PREVIEW_SIDE):
+    """
+    Render a layout at preview scale from thumbnails (see load_thumbnails); a few ms for hundreds of tiles
+    """
+    scale = min(1, max_side / max(width, height))
+    w, h = max(1, round(width*scale)), max(1, round(height*scale))
+    canvas = new_canvas(w, h, bgcolor)
+    for l, angle in zip(scale_layout(layout, w / width, h / height), angles):
+        img = thumbs[l["item"]["path"]]
+        if angle is not None and img.mode != "RGBA":
+            img = img.convert("RGBA")  # transparent corners
+        paste_tile(canvas, l, transform_tile(img, l["w"], l["h"], angle, "bilinear"))
+    return canvas
+
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="Folder with images")
-    parser.add_argument("--width", type=int, default=2560)
-    parser.add_argument("--height", type=int, default=1440)
+    parser.add_argument("--input", default=None, help="Folder with images")
+    parser.add_argument("--recursive", action="store_true", help="Include images in subfolders")
+    parser.add_argument("--include", action="append", default=None,
+                        help="Only use files whose path relative to the input folder matches this glob (repeatable)")
+    parser.add_argument("--exclude", action="append", default=None,
+                        help="Skip files and folders whose relative path matches this glob (repeatable)")
+    parser.add_argument("--max-files", type=int, default=None, help="Stop scanning after this many image files")
+    parser.add_argument("--max-images", type=int, default=None, help="Use a random sample of at most this many images")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Target tile size in pixels: use at most as many images as tiles of this size fit the canvas")
+    parser.add_argument("--stratify", choices=STRATIFY_MODES, default=None,
+                        help="Sample keeping the mix of aspect ratios, or evenly over the file dates")
+    parser.add_argument("--width", type=int, default=None, help="Width of the collage (default: 2560)")
+    parser.add_argument("--height", type=int, default=None, help="Height of the collage (default: 1440)")
     parser.add_argument("--bgcolor", default="#222222")
     parser.add_argument("--output", default="collage.png")
     parser.add_argument("--max-rotation", type=float, default=5)
     parser.add_argument("--overlap-factor", type=float, default=0.05)
     parser.add_argument("--rows", type=int, default=0, help="0=automatic, >0=number of rows")
     parser.add_argument("--iterations", type=int, default=15, help="Iterations for layout optimization")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for layout search and rendering (1=serial, 0=all cores)")
+    parser.add_argument("--layout", choices=LAYOUT_MODES, default="organic",
+                        help="Shuffled rows chosen by a random search, or justified rows partitioned evenly in one pass")
+    parser.add_argument("--row-search", choices=("pruned", "exhaustive"), default="pruned",
+                        help="Automatic row selection: search around an estimate or try 1..n rows")
+    parser.add_argument("--score", choices=("coverage", "rotated", "area"), default="coverage",
+                        help="Layout score: uncovered area + overlap, the same with rotated bounding boxes, or free area only")
+    parser.add_argument("--engine", choices=("auto", "python", "numpy"), default="auto", help="Layout engine (auto=numpy if installed)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible layouts (default: random)")
+    parser.add_argument("--resample", choices=tuple(RESAMPLE_FILTERS), default=DEFAULT_RESAMPLE,
+                        help="Tile filter: lanczos (default), or bicubic, bilinear or nearest (resize and rotate in one transform)")
+    parser.add_argument("--sizes", default=None,
+                        help="Additional output sizes from the same layout, e.g. 1280,320 (widths) or 1280x720")
+    parser.add_argument("--format", choices=("png", "jpeg", "webp"), default=None,
+                        help="Output format (default: from the output file extension)")
+    parser.add_argument("--quality", type=int, default=None, help=f"JPEG/WebP quality 1-100 (default: {DEFAULT_QUALITY})")
+    parser.add_argument("--compress-level", type=int, default=None,
+                        help="PNG zlib level 0-9 (default: 6), also sets the WebP method (speed vs. size)")
+    parser.add_argument("--lossless", action="store_true", help="Lossless WebP")
+    parser.add_argument("--strip-height", type=int, default=0,
+                        help="Render and write PNG output in bands of this many rows (0=whole canvas)")
+    parser.add_argument("--max-memory", type=int, default=None,
+                        help="Memory budget in MB for the canvas and decoded tiles in flight")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Keep the layout next to the output and only redo the rows affected by added or removed images")
+    parser.add_argument("--save-layout", default=None,
+                        help="Also write the layout (names, positions, sizes, angles, seed) as JSON to this file")
+    parser.add_argument("--from-layout", default=None,
+                        help="Render a layout saved with --save-layout (no scan, no layout search; size from the file)")
+    parser.add_argument("--cache", default=None, help="Cache directory for image metadata, reduced images and layouts")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024), help="Cache size limit in MB")
+    parser.add_argument("--cache-hash", action="store_true", help="Key the cache by file content instead of path, size and mtime")
+    parser.add_argument("--profile", action="store_true", help="Print wall time, CPU time and peak memory per stage")
+    parser.add_argument("--metrics", default=None, help="Write per-stage timings and counters as JSON to this file")
+    parser.add_argument("--profile-layout", default=None,
+                        help="Write cProfile stats of the layout search to this file (main process only, use --workers 1)")
     args = parser.parse_args()
+    if args.input is None and args.from_layout is None:
+        parser.error("--input is required (unless rendering a saved layout with --from-layout)")
+    if args.from_layout is not None and (args.width is not None or args.height is not None):
+        parser.error("--width/--height cannot be combined with --from-layout, the canvas size is taken from the "
+                     "layout (use --sizes for other sizes)")
+
+    metrics = {} if args.profile or args.metrics else None
+
+    cache = None
+    if args.cache:
+        cache = ImageCache(args.cache, args.cache_size * 1024*1024, args.cache_hash)
 
     bgcolor_rgb = parse_color(args.bgcolor)
     create_collage(
         args.input,
-        args.width,
-        args.height,
+        args.width or 2560,
+        args.height or 1440,
         bgcolor_rgb,
         args.output,
         max_rotation=args.max_rotation,
         overlap_factor=args.overlap_factor,
         rows=args.rows,
-        iterations=args.iterations
+        iterations=args.iterations,
+        workers=args.workers,
+        seed=args.seed,
+        engine=args.engine,
+        row_search=args.row_search,
+        scoring=args.score,
+        cache=cache,
+        strip_height=args.strip_height,
+        max_memory=args.max_memory * 1024*1024 if args.max_memory else None,
+        fmt=args.format,
+        quality=args.quality,
+        compress_level=args.compress_level,
+        lossless=args.lossless,
+        sizes=parse_sizes(args.sizes) if args.sizes else None,
+        metrics=metrics,
+        profile=args.profile_layout,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        max_files=args.max_files,
+        max_images=args.max_images,
+        tile_size=args.tile_size,
+        stratify=args.stratify,
+        layout_mode=args.layout,
+        incremental=args.incremental,
+        resample=args.resample,
+        save_layout=args.save_layout,
+        from_layout=args.from_layout
     )
+
+    if args.profile and metrics:
+        print_metrics(metrics)
+    if args.metrics and metrics:
+        write_metrics(metrics, args.metrics)
@@ -0,0 +1,178 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_batch.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: Batch runner for many collages sharing one scan and one decoded image pool per folder
+
+
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from collage import create_collage, load_images, parse_color, wait_for_saves, image_limit
+from collage_cache import ImageCache, MemoryCache, DEFAULT_CACHE_SIZE
+
+# Job spec keys (as saved by the GUI) that map 1:1 to create_collage parameters
+JOB_PARAMS = ("width", "height", "max_rotation", "overlap_factor", "rows", "iterations", "seed", "engine", "row_search",
+              "scoring", "strip_height", "fmt", "quality", "compress_level", "lossless", "sizes", "layout_mode",
+              "incremental", "resample", "save_layout")
+
+# Job spec keys that select the input files (plus max_images, tile_size and stratify for sampling);
+# jobs with the same folder and selection share one scan
+SCAN_PARAMS = ("recursive", "include", "exclude", "max_files")
+
+# Job spec keys for sampling that map 1:1 to create_collage parameters
+SAMPLE_PARAMS = ("max_images", "tile_size", "stratify")
+
+
+def load_jobs(paths):
+    """
+    Read job specs from JSON files: a single spec (a saved GUI config), a list of specs or {"jobs": [...]}
+    """
+    jobs = []
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("jobs", [data])
+        jobs.extend(data)
+    return jobs
+
+
+def job_params(spec):
+    # create_collage keyword arguments for a job spec
+    params = {key: spec[key] for key in JOB_PARAMS if key in spec}
+    params["input_dir"] = spec["input_folder"]
+    params["output"] = os.path.join(spec.get("output_folder", "."), spec.get("output_file", "collage.png"))
+    params.setdefault("width", 2560)
+    params.setdefault("height", 1440)
+    params["bgcolor"] = parse_color(spec.get("bgcolor", "transparent"))
+    return params
+
+
+def collage_params(spec):
+    # create_collage keyword arguments for a job spec run on its own, including the input selection
+    params = job_params(spec)
+    params.update({key: spec[key] for key in SCAN_PARAMS + SAMPLE_PARAMS if key in spec})
+    return params
+
+
+def scan_params(spec):
+    # load_images keyword arguments for a job spec
+    params = {key: spec[key] for key in SCAN_PARAMS if key in spec}
+    limit = image_limit(spec.get("width", 2560), spec.get("height", 1440), spec.get("max_images"), spec.get("tile_size"))
+    if limit:
+        params.update(max_images=limit, stratify=spec.get("stratify"), seed=spec.get("seed", 0))
+    return params
+
+
+def scan_key(spec):
+    return json.dumps([spec["input_folder"], scan_params(spec)], sort_keys=True)
+
+
+def run_job(spec, items, cache):
+    # Run time, error (None if fine) and the pending background writes of one job
+    started = time.perf_counter()
+    if isinstance(items, Exception):
+        return 0.0, f"Could not scan input folder: {items}", []
+    saves = []
+    try:
+        result = create_collage(items=items, cache=cache, background_save=True, saves=saves, **job_params(spec))
+        error = None if result else "No images found"
+    except Exception as e:
+        error = str(e)
+    return time.perf_counter() - started, error, saves
+
+
+def run_batch(specs, workers=1, cache=None):
+    """
+    Run all jobs on a thread pool. Each distinct input folder is scanned once, and decoded
+    image levels are shared between jobs through the cache (in memory unless an ImageCache is given).
+    Returns one summary entry per job.
+    """
+    cache = cache if cache is not None else MemoryCache()
+    scans = {}
+    for spec in specs:
+        key = scan_key(spec)
+        if key in scans:
+            continue
+        folder = spec["input_folder"]
+        started = time.perf_counter()
+        try:
+            scans[key] = load_images(folder, cache, **scan_params(spec))
+            print(f"Scanned {folder}: {len(scans[key])} images in {time.perf_counter() - started:.2f}s")
+        except OSError as e:
+            # Reported for each job of this folder
+            scans[key] = e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(run_job, spec, scans[scan_key(spec)], cache) for spec in specs]
+        results = [future.result() for future in futures]
+
+    # Encoding runs in the background; a job is only done once its files are written
+    summary = []
+    for spec, (seconds, error, saves) in zip(specs, results):
+        try:
+            wait_for_saves(saves)
+        except Exception as e:
+            error = error or f"Could not save: {e}"
+        summary.append({"output": job_params(spec)["output"], "seconds": round(seconds, 3), "error": error})
+    return summary
+
+
+def print_summary(summary, total):
+    width = max([len(job["output"]) for job in summary] + [6])
+    print(f"{'Output':<{width}}  {'Time':>8}  Status")
+    for job in summary:
+        print(f"{job['output']:<{width}}  {job['seconds']:>7.2f}s  {job['error'] or 'OK'}")
+    print(f"{len(summary)} jobs in {total:.2f}s")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Run many collage jobs, sharing scans and decoded images")
+    parser.add_argument("jobs", nargs="+", help="JSON files with job specs (saved GUI configs or lists of them)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Jobs run in parallel")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024),
+                        help="Size limit of the shared in-memory image pool in MB")
+    parser.add_argument("--cache", default=None, help="Use this on-disk cache directory instead of the in-memory pool")
+    parser.add_argument("--summary", default=None, help="Write per-job timings as JSON to this file")
+    args = parser.parse_args()
+
+    if args.cache:
+        cache = ImageCache(args.cache)
+    else:
+        cache = MemoryCache(args.pool_size * 1024*1024)
+
+    started = time.perf_counter()
+    summary = run_batch(load_jobs(args.jobs), args.workers, cache)
+    total = time.perf_counter() - started
+    print_summary(summary, total)
+
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump({"jobs": summary, "seconds": round(total, 3)}, f, indent=4)
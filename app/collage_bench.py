@@ -0,0 +1,232 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_bench.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: Benchmarks on deterministic synthetic image sets, with results that can be compared between runs
+
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+from PIL import Image, ImageDraw, __version__ as PIL_VERSION
+
+from collage import create_collage, load_images, compute_layout, estimate_rows, np
+
+# Longest image side per resolution profile
+RESOLUTIONS = {
+    "small": [640, 800, 1024],
+    "medium": [1600, 2048, 2400],
+    "large": [3000, 4000, 6000],
+}
+RESOLUTIONS["mixed"] = RESOLUTIONS["small"] + RESOLUTIONS["medium"] + RESOLUTIONS["large"]
+
+# Width:height ratios per aspect profile
+ASPECTS = {
+    "landscape": [(4, 3), (3, 2), (16, 9)],
+    "portrait": [(3, 4), (2, 3), (9, 16)],
+    "square": [(1, 1)],
+}
+ASPECTS["mixed"] = ASPECTS["landscape"] + ASPECTS["portrait"] + ASPECTS["square"]
+
+FORMATS = ("jpeg", "png", "mixed")
+
+
+# --------------------------------------------------------------
+# Synthetic corpus
+# --------------------------------------------------------------
+
+def corpus_spec(count, resolution="medium", aspects="mixed", fmt="jpeg", seed=0):
+    return {"count": count, "resolution": resolution, "aspects": aspects, "format": fmt, "seed": seed}
+
+def synthetic_image(rng, w, h):
+    # A gradient with a few shapes: compresses roughly like a photo, unlike a flat color
+    img = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    tint = Image.new("RGB", (w, h), tuple(rng.randrange(256) for _ in range(3)))
+    img = Image.blend(img, tint, 0.6)
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(w), rng.randrange(h)
+        r = rng.randrange(max(2, min(w, h) // 4))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+def generate_corpus(directory, spec):
+    """
+    Write spec["count"] images into directory. The same spec always gives the same files;
+    an existing corpus with a matching spec is reused.
+    """
+    manifest = os.path.join(directory, "corpus.json")
+    try:
+        with open(manifest, "r") as f:
+            if json.load(f) == spec:
+                return directory
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+
+    rng = random.Random(spec["seed"])
+    for i in range(spec["count"]):
+        side = rng.choice(RESOLUTIONS[spec["resolution"]])
+        aw, ah = rng.choice(ASPECTS[spec["aspects"]])
+        w, h = (side, round(side * ah / aw)) if aw >= ah else (round(side * aw / ah), side)
+        fmt = spec["format"] if spec["format"] != "mixed" else rng.choice(("jpeg", "png"))
+        img = synthetic_image(rng, w, h)
+        if fmt == "jpeg":
+            img.save(os.path.join(directory, f"img{i:05d}.jpg"), "JPEG", quality=85)
+        else:
+            img.save(os.path.join(directory, f"img{i:05d}.png"), "PNG", compress_level=1)
+
+    with open(manifest, "w") as f:
+        json.dump(spec, f)
+    return directory
+
+
+# --------------------------------------------------------------
+# Timing
+# --------------------------------------------------------------
+
+def measure(fn, repeat):
+    # Run fn repeat times with its console output suppressed; min and median wall time in seconds
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            fn()
+        times.append(time.perf_counter() - started)
+    return {"min": round(min(times), 4), "median": round(statistics.median(times), 4)}
+
+def run_benchmarks(corpus_dir, spec, canvases, iteration_counts, repeat=3, workers=1, seed=0):
+    """
+    Time load_images, compute_layout (fixed and automatic rows) and create_collage for every
+    canvas size and iteration count. Returns one result per benchmark and parameter combination.
+    """
+    directory = generate_corpus(os.path.join(corpus_dir, corpus_name(spec)), spec)
+    items = load_images(directory)
+    results = [{"bench": "load_images", "images": len(items), **measure(lambda: load_images(directory), repeat)}]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "collage.png")
+        for width, height in canvases:
+            rows = estimate_rows(items, width, height)
+            for iterations in iteration_counts:
+                params = {"images": len(items), "canvas": f"{width}x{height}", "iterations": iterations}
+                results.append({"bench": "layout_fixed_rows", **params, **measure(
+                    lambda: compute_layout(items, width, height, rows, 0.05, iterations, seed, workers), repeat)})
+                results.append({"bench": "layout_auto_rows", **params, **measure(
+                    lambda: compute_layout(items, width, height, 0, 0.05, iterations, seed, workers), repeat)})
+                results.append({"bench": "create_collage", **params, **measure(
+                    lambda: create_collage(directory, width, height, (34, 34, 34), output, iterations=iterations,
+                                           workers=workers, seed=seed), repeat)})
+    return results
+
+def corpus_name(spec):
+    return f"{spec['count']}_{spec['resolution']}_{spec['aspects']}_{spec['format']}_{spec['seed']}"
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL_VERSION,
+        "numpy": np.__version__ if np is not None else None,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# --------------------------------------------------------------
+# Reporting
+# --------------------------------------------------------------
+
+def result_key(result):
+    # Identifies the same measurement across runs
+    return (result["bench"], result["images"], result.get("canvas", ""), result.get("iterations", 0))
+
+def print_results(results, baseline=None):
+    base = {result_key(r): r for r in baseline or []}
+    print(f"{'Benchmark':<18} {'Images':>6} {'Canvas':>10} {'Iter':>5} {'Median':>9} {'Min':>9}" +
+          (f" {'Base':>9} {'Speedup':>8}" if baseline else ""))
+    for r in results:
+        line = (f"{r['bench']:<18} {r['images']:>6} {r.get('canvas', '-'):>10} {r.get('iterations', '-'):>5} "
+                f"{r['median']:>8.3f}s {r['min']:>8.3f}s")
+        if baseline:
+            old = base.get(result_key(r))
+            if old is None:
+                line += f" {'-':>9} {'-':>8}"
+            else:
+                line += f" {old['median']:>8.3f}s {old['median'] / max(r['median'], 1e-9):>7.2f}x"
+        print(line)
+
+def parse_canvases(spec):
+    return [tuple(int(v) for v in part.lower().split("x")) for part in spec.split(",") if part.strip()]
+
+def parse_ints(spec):
+    return [int(part) for part in spec.split(",") if part.strip()]
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image loading, layout search and rendering on synthetic images")
+    parser.add_argument("--images", default="50,200", help="Image counts, one corpus each")
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="medium", help="Image size profile")
+    parser.add_argument("--aspects", choices=sorted(ASPECTS), default="mixed", help="Aspect ratio profile")
+    parser.add_argument("--format", choices=FORMATS, default="jpeg", help="Image file format")
+    parser.add_argument("--canvas", default="1280x720,2560x1440", help="Canvas sizes")
+    parser.add_argument("--iterations", default="15,60", help="Iteration counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (min and median are reported)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for layout search and rendering")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus and the layouts")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "collage_bench"),
+                        help="Where generated image sets are kept between runs")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for count in parse_ints(args.images):
+        spec = corpus_spec(count, args.resolution, args.aspects, args.format, args.seed)
+        print(f"Corpus {corpus_name(spec)} ...", file=sys.stderr)
+        results.extend(run_benchmarks(args.corpus_dir, spec, parse_canvases(args.canvas), parse_ints(args.iterations),
+                                      args.repeat, args.workers, args.seed))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "corpus": {"resolution": args.resolution, "aspects": args.aspects,
+                       "format": args.format, "seed": args.seed}, "results": results}, f, indent=4)
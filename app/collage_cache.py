@@ -0,0 +1,279 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_cache.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: On-disk and in-memory caches for image metadata, reduced image levels and layouts
+
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GB
+
+# Entry limits of the in-memory metadata and layout caches (a few hundred bytes per image, up to about
+# 100 KB per layout of a large folder), so a long-running process does not grow with every image it sees
+MEMORY_INFO_ENTRIES = 100000
+MEMORY_LAYOUT_ENTRIES = 200
+
+
+class ImageCache:
+    """
+    Cache directory with one entry per source image, keyed by path + size + mtime (or content hash).
+    An entry is <key>.json with dimensions and orientation plus <key>_<width>x<height>.png per
+    pyramid level. Computed layouts are stored as layout_<key>.json. Reads touch the entry files,
+    so evict() can remove the least recently used entries once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE, hash_content=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        os.makedirs(directory, exist_ok=True)
+
+    # ----------------------------------------------------------
+    # Keys
+    # ----------------------------------------------------------
+
+    def key_for(self, path, stat=None):
+        if self.hash_content:
+            digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        stat = stat or os.stat(path)
+        data = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    @staticmethod
+    def key_for_data(data):
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    # ----------------------------------------------------------
+    # Metadata and pyramid levels
+    # ----------------------------------------------------------
+
+    def load_info(self, key):
+        return self.read_json(f"{key}.json")
+
+    def store_info(self, key, info):
+        self.write_json(f"{key}.json", info)
+
+    def load_level(self, key, size):
+        """
+        Return the smallest cached level that is at least size, or None
+        """
+        info = self.load_info(key)
+        if not info:
+            return None
+        fitting = [tuple(s) for s in info.get("levels", []) if s[0] >= size[0] and s[1] >= size[1]]
+        if not fitting:
+            return None
+        path = self.level_path(key, min(fitting))
+        try:
+            with Image.open(path) as img:
+                img = img.convert("RGBA")
+        except OSError:
+            return None
+        self.touch(path)
+        return img
+
+    def has_levels(self, key):
+        info = self.load_info(key)
+        return bool(info) and "levels" in info
+
+    def store_levels(self, key, info, levels):
+        for img in levels:
+            self.write_file(self.level_path(key, img.size), lambda f, img=img: img.save(f, "PNG", compress_level=1))
+        self.store_info(key, {**info, "levels": [list(img.size) for img in levels]})
+
+    def level_path(self, key, size):
+        return os.path.join(self.directory, f"{key}_{size[0]}x{size[1]}.png")
+
+    # ----------------------------------------------------------
+    # Layouts
+    # ----------------------------------------------------------
+
+    def load_layout(self, key):
+        return self.read_json(f"layout_{key}.json")
+
+    def store_layout(self, key, data):
+        self.write_json(f"layout_{key}.json", data)
+
+    # ----------------------------------------------------------
+    # LRU eviction
+    # ----------------------------------------------------------
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits into max_bytes
+        """
+        entries = {}
+        for e in os.scandir(self.directory):
+            if not e.is_file() or e.name.startswith("."):
+                continue
+            st = e.stat()
+            # <key>.json, <key>_<size>.png and layout_<key>.json group by their key
+            name = e.name.split(".")[0]
+            group = name if name.startswith("layout_") else name.split("_")[0]
+            size, used, paths = entries.get(group, (0, 0, []))
+            entries[group] = (size + st.st_size, max(used, st.st_mtime), paths + [e.path])
+
+        total = sum(size for size, _, _ in entries.values())
+        for size, _, paths in sorted(entries.values(), key=lambda entry: entry[1]):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    # ----------------------------------------------------------
+    # File helpers
+    # ----------------------------------------------------------
+
+    def read_json(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.touch(path)
+        return data
+
+    def write_json(self, name, data):
+        self.write_file(os.path.join(self.directory, name), lambda f: f.write(json.dumps(data).encode()))
+
+    def write_file(self, path, write):
+        # Write to a temporary file and rename, so concurrent readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    @staticmethod
+    def touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+class MemoryCache:
+    """
+    In-process counterpart of ImageCache with the same interface, for sharing decoded pyramid
+    levels between collages rendered by threads of one process (e.g. batch jobs).
+    Levels of the least recently used images are dropped once they exceed max_bytes; image metadata and
+    layouts are dropped least recently used beyond MEMORY_INFO_ENTRIES and MEMORY_LAYOUT_ENTRIES entries.
+    Cached images are shared and must only be read.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.info = OrderedDict()
+        self.levels = OrderedDict()
+        self.layouts = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def key_for(self, path, stat=None):
+        stat = stat or os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    key_for_data = staticmethod(ImageCache.key_for_data)
+
+    def load_info(self, key):
+        with self.lock:
+            return self.load_entry(self.info, key)
+
+    def store_info(self, key, info):
+        with self.lock:
+            self.store_entry(self.info, key, info, MEMORY_INFO_ENTRIES)
+
+    def has_levels(self, key):
+        with self.lock:
+            return key in self.levels
+
+    def load_level(self, key, size):
+        with self.lock:
+            levels = self.levels.get(key)
+            if levels is None:
+                return None
+            self.levels.move_to_end(key)
+        fitting = [img for img in levels if img.width >= size[0] and img.height >= size[1]]
+        return fitting[-1] if fitting else None
+
+    def store_levels(self, key, info, levels):
+        with self.lock:
+            self.store_entry(self.info, key, info, MEMORY_INFO_ENTRIES)
+            if key in self.levels:
+                return
+            self.levels[key] = levels
+            self.size += sum(img.width * img.height * 4 for img in levels)
+            self.evict_locked()
+
+    def load_layout(self, key):
+        with self.lock:
+            return self.load_entry(self.layouts, key)
+
+    def store_layout(self, key, data):
+        with self.lock:
+            self.store_entry(self.layouts, key, data, MEMORY_LAYOUT_ENTRIES)
+
+    @staticmethod
+    def load_entry(entries, key):
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+    @staticmethod
+    def store_entry(entries, key, value, limit):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def evict(self):
+        with self.lock:
+            self.evict_locked()
+
+    def evict_locked(self):
+        while self.size > self.max_bytes and len(self.levels) > 1:
+            _, levels = self.levels.popitem(last=False)
+            self.size -= sum(img.width * img.height * 4 for img in levels)
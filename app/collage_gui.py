@@ -30,10 +30,12 @@
 
 import json
 import os
+import random
 import sys
+import threading
 from datetime import datetime
 
-from PySide6.QtGui import QAction, QFont, QPixmap,QIcon
+from PySide6.QtGui import QAction, QFont, QPixmap,QIcon, QImage
 from PySide6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -49,11 +51,13 @@ from PySide6.QtWidgets import (
     QMenuBar,
     QMenu,  
     QSizePolicy,
-    QSpacerItem
+    QSpacerItem,
+    QProgressBar
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QObject, QThread, QTimer, Signal, Slot
 
-from collage import create_collage, parse_color
+from collage import (create_collage, parse_color, CollageCancelled, load_images, load_thumbnails,
+                     compute_layout, rotation_angles, render_preview)
 
 
 # --------------------------------------------------------------
@@ -75,6 +79,15 @@ DEFAULTS = {
     "output_file": "collage.png"
 }
 
+# Preview pane size and the delay after the last edit before the preview is laid out again
+PREVIEW_WIDTH = 440
+PREVIEW_HEIGHT = 330
+PREVIEW_DEBOUNCE_MS = 300
+
+# The preview first shows a draft layout scored by free area only (about 25 ms for 300 images instead of
+# more than half a second with coverage scoring), then the exact layout that Run renders, searched in the background
+PREVIEW_SCORING = "area"
+
 # Default input/output folder: ~/Documents
 DEFAULT_FOLDER = os.path.join(os.path.expanduser("~"), "Documents")
 
@@ -99,6 +112,97 @@ def get_app_config_path():
 APP_CONFIG_FILE = get_app_config_path()
 
 
+# --------------------------------------------------------------
+# Background Worker
+# --------------------------------------------------------------
+
+STAGE_LABELS = {
+    "loading": "Reading images",
+    "layout": "Searching layout",
+    "render": "Rendering",
+    "save": "Saving"
+}
+
+
+class CollageWorker(QObject):
+    """
+    Runs create_collage on a QThread and reports progress through signals,
+    so the window stays responsive and the job can be cancelled.
+    """
+
+    progress = Signal(str, int, int)  # stage, done, total (0 = unknown)
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, params):
+        super().__init__()
+        self.params = params
+        self.cancel_event = threading.Event()
+
+    @Slot()
+    def run(self):
+        try:
+            result = create_collage(progress=self.report, cancel=self.cancel_event.is_set, **self.params)
+            self.finished.emit(result)
+        except CollageCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def report(self, stage, done, total):
+        self.progress.emit(stage, done, total or 0)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class PreviewWorker(QObject):
+    """
+    Computes preview layouts on a background thread: a fast draft, then the exact layout that Run renders.
+    Thumbnails are loaded once per input folder; requests that were superseded by newer edits are skipped or cancelled.
+    """
+
+    request = Signal(object)
+    ready = Signal(object)
+    failed = Signal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        self.folder = None
+        self.items = None
+        self.thumbs = None
+        self.latest = 0
+        self.request.connect(self.compute)
+
+    @Slot(object)
+    def compute(self, params):
+        generation = params["generation"]
+        stale = lambda: generation != self.latest
+        if stale():
+            return
+        try:
+            if params["input_dir"] != self.folder:
+                self.folder = None
+                self.items = load_images(params["input_dir"], cancel=stale)
+                self.thumbs = load_thumbnails(self.items, cancel=stale)
+                self.folder = params["input_dir"]
+            if not self.items:
+                self.ready.emit({"params": params, "items": self.items, "thumbs": self.thumbs, "layout": None,
+                                 "exact": True})
+                return
+            for scoring in (PREVIEW_SCORING, "coverage"):
+                layout = compute_layout(self.items, params["width"], params["height"], params["rows"],
+                                        params["overlap_factor"], params["iterations"], params["seed"],
+                                        scoring=scoring, max_rotation=params["max_rotation"], cancel=stale)
+                self.ready.emit({"params": params, "items": self.items, "thumbs": self.thumbs, "layout": layout,
+                                 "exact": scoring == "coverage"})
+        except CollageCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(generation, str(e))
+
+
 # --------------------------------------------------------------
 # Main App Class
 # --------------------------------------------------------------
@@ -109,27 +213,43 @@ class CollageApp(QMainWindow):
 
         self.recent_configs = []
         self.current_config_path = None
+        self.worker = None
+        self.worker_thread = None
+        self.preview_seed = random.SystemRandom().randrange(2**32)
+        self.preview_generation = 0
+        self.preview_result = None
 
         self.setWindowTitle(FULL_TITLE)
-        self.setFixedSize(700, 608)
+        self.setFixedSize(700 + PREVIEW_WIDTH + 15, 660)
 
         # zentraler Widget-Container
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
 
-        # nur ein Layout für alles
+        # Formular links, Vorschau rechts
+        outer_layout = QHBoxLayout()
+        outer_layout.setContentsMargins(0, 0, 15, 0)
+        outer_layout.setSpacing(0)
+        self.central_widget.setLayout(outer_layout)
+
         self.main_layout = QVBoxLayout()
         self.main_layout.setContentsMargins(15, 10, 15, 10)
         self.main_layout.setSpacing(10)
-        self.central_widget.setLayout(self.main_layout)
+        outer_layout.addLayout(self.main_layout)
+
+        self.preview_layout = QVBoxLayout()
+        self.preview_layout.setSpacing(10)
+        outer_layout.addLayout(self.preview_layout)
 
         # Setup UI und Menü
         self.setup_ui()
+        self.setup_preview()
         self.setup_menu()
 
         self.load_app_config()
         self.try_load_last_used_config()
         self.update_window_title()
+        self.schedule_preview()
 
     # ----------------------------------------------------------
     # UI Construction
@@ -194,9 +314,21 @@ class CollageApp(QMainWindow):
 
         layout.addSpacerItem(QSpacerItem(0, 10, QSizePolicy.Minimum, QSizePolicy.Fixed))
 
+        # ------------------ PROGRESS ------------------------------
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setFixedHeight(8)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        layout.addWidget(self.progress_bar)
+
+        self.status_label = QLabel("Ready")
+        self.status_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.status_label)
+
         btn_container = QWidget()
         btn_container.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Minimum)
-        btn_container.setFixedWidth(176)
+        btn_container.setFixedWidth(260)
         btn_container.setFixedHeight(32)
 
         btns = QHBoxLayout(btn_container)
@@ -207,6 +339,12 @@ class CollageApp(QMainWindow):
         run_btn = QPushButton("Run")
         run_btn.setFixedSize(80, 32)
         run_btn.clicked.connect(self.run_collage)
+        self.run_btn = run_btn
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setFixedSize(80, 32)
+        cancel_btn.setEnabled(False)
+        cancel_btn.clicked.connect(self.cancel_collage)
+        self.cancel_btn = cancel_btn
         exit_btn = QPushButton("Exit")
         exit_btn.setFixedSize(80, 32)
         exit_btn.clicked.connect(self.close)
@@ -223,6 +361,29 @@ class CollageApp(QMainWindow):
             }
         """)
 
+        run_btn.setStyleSheet(run_btn.styleSheet() + """
+            QPushButton:disabled {
+                background-color: #2a5580;
+                color: #a0a0a0;
+            }
+        """)
+
+        cancel_btn.setStyleSheet("""
+            QPushButton {
+                padding: 8px 16px;
+                border-radius: 6px;
+                background-color: #cc5544;
+                color: white;
+            }
+            QPushButton:hover {
+                background-color: #dd6655;
+            }
+            QPushButton:disabled {
+                background-color: #4a4a4a;
+                color: #909090;
+            }
+        """)
+
         exit_btn.setStyleSheet("""
             QPushButton {
                 padding: 8px 16px;
@@ -236,11 +397,60 @@ class CollageApp(QMainWindow):
         """)
 
         btns.addWidget(run_btn)
+        btns.addWidget(cancel_btn)
         btns.addWidget(exit_btn)
         layout.addWidget(btn_container, alignment=Qt.AlignCenter)
 
         layout.addSpacerItem(QSpacerItem(0, 6, QSizePolicy.Minimum, QSizePolicy.Fixed))
 
+    def setup_preview(self):
+        layout = self.preview_layout
+        layout.addStretch()
+
+        self.preview_label = QLabel()
+        self.preview_label.setFixedSize(PREVIEW_WIDTH, PREVIEW_HEIGHT)
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setStyleSheet("background-color: #111111; border-radius: 6px; color: #909090;")
+        layout.addWidget(self.preview_label)
+
+        hbox = QHBoxLayout()
+        self.preview_status = QLabel("Preview")
+        hbox.addWidget(self.preview_status)
+        hbox.addStretch()
+
+        shuffle_btn = QPushButton("Shuffle")
+        shuffle_btn.setStyleSheet("""
+            QPushButton {
+                padding: 6px 12px;
+                border-radius: 6px;
+                background-color: #3399ff;
+                color: white;
+            }
+            QPushButton:hover {
+                background-color: #55aaff;
+            }
+        """)
+        shuffle_btn.clicked.connect(self.shuffle_preview)
+        hbox.addWidget(shuffle_btn)
+        layout.addLayout(hbox)
+        layout.addStretch()
+
+        # Re-layout shortly after the last edit, rendering waits for Run
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.request_preview)
+        for edit in (self.input_folder_edit, self.width_edit, self.height_edit, self.bgcolor_edit,
+                     self.max_rotation_edit, self.overlap_edit, self.rows_edit, self.iterations_edit):
+            edit.textChanged.connect(self.schedule_preview)
+
+        self.preview_thread = QThread(self)
+        self.preview_worker = PreviewWorker()
+        self.preview_worker.moveToThread(self.preview_thread)
+        self.preview_worker.ready.connect(self.preview_ready)
+        self.preview_worker.failed.connect(self.preview_failed)
+        self.preview_thread.start()
+
     # ----------------------------------------------------------
     # Menu
     # ----------------------------------------------------------
@@ -396,6 +606,9 @@ class CollageApp(QMainWindow):
     # ----------------------------------------------------------
 
     def run_collage(self):
+        if self.worker_thread is not None:
+            return
+
         input_dir = self.input_folder_edit.text().strip()
         output_dir = self.output_folder_edit.text().strip()
         output_file = self.output_file_edit.text().strip() or "collage.png"
@@ -410,28 +623,192 @@ class CollageApp(QMainWindow):
         full_output_path = os.path.join(output_dir, output_file)
 
         try:
-            bgcolor_rgb = parse_color(self.bgcolor_edit.text())
-            result = create_collage(
+            params = dict(
                 input_dir=input_dir,
                 width=int(self.width_edit.text()),
                 height=int(self.height_edit.text()),
-                bgcolor=bgcolor_rgb,
+                bgcolor=parse_color(self.bgcolor_edit.text()),
                 output=full_output_path,
                 max_rotation=float(self.max_rotation_edit.text()),
                 overlap_factor=float(self.overlap_edit.text()),
                 rows=int(self.rows_edit.text()),
-                iterations=int(self.iterations_edit.text())
+                iterations=int(self.iterations_edit.text()),
+                seed=self.preview_seed
             )
-
-            if not result:  # If create_collage None or empty list returns
-                self.show_warning("No Images Found",
-                                f"No image files were found in the folder:\n{input_dir}")
-                return
-        
-            self.show_info("Success", f"Collage Created!\nSaved to:\n{full_output_path}")
-
         except Exception as e:
             self.show_error("Error", str(e))
+            return
+
+        # Reuse the images scanned for the preview, and its layout once the exact one is shown;
+        # while only the draft is shown, the same exact layout is searched again
+        result = self.preview_result
+        if result is not None and result["items"] and result["params"]["input_dir"] == input_dir:
+            params["items"] = result["items"]
+            if result["exact"] and self.layout_key(result["params"]) == self.layout_key(params):
+                params["layout"] = result["layout"]
+
+        # Run on a worker thread, the result arrives through the signals below
+        self.worker_thread = QThread(self)
+        self.worker = CollageWorker(params)
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.update_progress)
+        # Bound slots of the window, so they are queued to the UI thread
+        self.worker.finished.connect(self.collage_finished)
+        self.worker.failed.connect(self.collage_failed)
+        self.worker.cancelled.connect(self.collage_cancelled)
+
+        self.set_running(True)
+        self.worker_thread.start()
+
+    def cancel_collage(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.status_label.setText("Cancelling…")
+
+    def update_progress(self, stage, done, total):
+        label = STAGE_LABELS.get(stage, stage)
+        if total > 0:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+            self.status_label.setText(f"{label} ({done}/{total})")
+        else:
+            # Unknown total: busy indicator
+            self.progress_bar.setRange(0, 0)
+            self.status_label.setText(f"{label} ({done})")
+
+    def collage_finished(self, result):
+        params = self.worker.params
+        self.stop_worker()
+        if not result:  # If create_collage None or empty list returns
+            self.status_label.setText("Ready")
+            self.show_warning("No Images Found",
+                            f"No image files were found in the folder:\n{params['input_dir']}")
+            return
+        self.status_label.setText("Done")
+        self.show_info("Success", f"Collage Created!\nSaved to:\n{params['output']}")
+
+    def collage_failed(self, message):
+        self.stop_worker()
+        self.status_label.setText("Failed")
+        self.show_error("Error", message)
+
+    def collage_cancelled(self):
+        self.stop_worker()
+        self.status_label.setText("Cancelled")
+
+    def stop_worker(self):
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+        self.worker.deleteLater()
+        self.worker_thread.deleteLater()
+        self.worker = None
+        self.worker_thread = None
+        self.set_running(False)
+
+    def set_running(self, running):
+        self.run_btn.setEnabled(not running)
+        self.cancel_btn.setEnabled(running)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        if running:
+            self.status_label.setText("Starting…")
+
+    # ----------------------------------------------------------
+    # Preview
+    # ----------------------------------------------------------
+
+    @staticmethod
+    def layout_key(params):
+        # Parameters that change the layout (the background color only changes the rendering)
+        return tuple(params[k] for k in ("input_dir", "width", "height", "rows", "overlap_factor",
+                                         "iterations", "max_rotation", "seed"))
+
+    def preview_params(self):
+        return {
+            "input_dir": self.input_folder_edit.text().strip(),
+            "width": int(self.width_edit.text()),
+            "height": int(self.height_edit.text()),
+            "bgcolor": parse_color(self.bgcolor_edit.text()),
+            "max_rotation": float(self.max_rotation_edit.text()),
+            "overlap_factor": float(self.overlap_edit.text()),
+            "rows": int(self.rows_edit.text()),
+            "iterations": int(self.iterations_edit.text()),
+            "seed": self.preview_seed
+        }
+
+    def schedule_preview(self):
+        self.preview_timer.start()
+
+    def shuffle_preview(self):
+        self.preview_seed = random.SystemRandom().randrange(2**32)
+        self.request_preview()
+
+    def request_preview(self):
+        try:
+            params = self.preview_params()
+            if params["width"] <= 0 or params["height"] <= 0 or params["iterations"] <= 0:
+                raise ValueError()
+        except Exception:
+            self.preview_status.setText("Invalid parameters")
+            return
+        if not os.path.isdir(params["input_dir"]):
+            self.preview_status.setText("Input folder not found")
+            return
+
+        result = self.preview_result
+        if result is not None and self.layout_key(result["params"]) == self.layout_key(params):
+            # Same layout, e.g. only the background color changed: just render again
+            result["params"] = {**result["params"], "bgcolor": params["bgcolor"]}
+            self.show_preview(result)
+            return
+
+        self.preview_generation += 1
+        params["generation"] = self.preview_generation
+        self.preview_worker.latest = self.preview_generation  # older requests are skipped or cancelled
+        self.preview_status.setText("Updating preview…")
+        self.preview_worker.request.emit(params)
+
+    def preview_ready(self, result):
+        if result["params"]["generation"] != self.preview_generation:
+            return
+        self.preview_result = result
+        self.show_preview(result)
+
+    def preview_failed(self, generation, message):
+        if generation == self.preview_generation:
+            self.preview_status.setText("Preview failed")
+            self.preview_label.setText(message)
+
+    def show_preview(self, result):
+        params = result["params"]
+        if not result["layout"]:
+            self.preview_label.setText("No images found")
+            self.preview_status.setText("Preview")
+            return
+        width, height = params["width"], params["height"]
+        scale = min(PREVIEW_WIDTH / width, PREVIEW_HEIGHT / height)
+        layout = result["layout"]
+        angles = rotation_angles(params["seed"], len(layout), params["max_rotation"])
+        img = render_preview(layout, angles, result["thumbs"], width, height, params["bgcolor"],
+                             round(max(width, height) * scale)).convert("RGBA")
+        data = img.tobytes()
+        qimage = QImage(data, img.width, img.height, 4 * img.width, QImage.Format_RGBA8888).copy()
+        self.preview_label.setPixmap(QPixmap.fromImage(qimage))
+        status = f"{len(layout)} images, seed {params['seed']}"
+        self.preview_status.setText(status if result["exact"] else f"{status} (draft layout)")
+
+    def closeEvent(self, event):
+        # Stop a running job and the preview thread before the window goes away
+        if self.worker_thread is not None:
+            self.worker.cancel()
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+        self.preview_worker.latest = -1
+        self.preview_thread.quit()
+        self.preview_thread.wait()
+        super().closeEvent(event)
 
     # ----------------------------------------------------------
     # CONFIG PARAM SAVE / LOAD (user files)
@@ -448,7 +825,8 @@ class CollageApp(QMainWindow):
             "max_rotation": float(self.max_rotation_edit.text()),
             "overlap_factor": float(self.overlap_edit.text()),
             "rows": int(self.rows_edit.text()),
-            "iterations": int(self.iterations_edit.text())
+            "iterations": int(self.iterations_edit.text()),
+            "seed": self.preview_seed
         }
 
     def apply_params(self, params):
@@ -462,6 +840,9 @@ class CollageApp(QMainWindow):
         self.overlap_edit.setText(str(params.get("overlap_factor", DEFAULTS["overlap_factor"])))
         self.rows_edit.setText(str(params.get("rows", DEFAULTS["rows"])))
         self.iterations_edit.setText(str(params.get("iterations", DEFAULTS["iterations"])))
+        seed = params.get("seed")
+        self.preview_seed = seed if seed is not None else random.SystemRandom().randrange(2**32)
+        self.schedule_preview()
 
     # ----------------------------------------------------------
     # New Config
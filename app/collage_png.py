@@ -0,0 +1,134 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_png.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: Streaming PNG writer that encodes an image band by band
+
+
+import os
+import struct
+import zlib
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:  # optional, enables the "Up" row filter
+    np = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+COLOR_TYPES = {"RGB": (2, 3), "RGBA": (6, 4)}  # mode: (PNG color type, bytes per pixel)
+
+# Read once at import (os.umask can only be queried by setting it)
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def temp_path(path):
+    """
+    Create a new hidden temporary file next to path (collage.png -> .collage.png.k3j2x9.tmp) and return its name.
+    Each writer gets its own file, so concurrent writes of the same output cannot mix, and the final rename
+    is atomic. The permissions are those of a normally created file, since the file becomes the output.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    os.chmod(tmp, 0o666 & ~UMASK)
+    return tmp
+
+
+class PngStreamWriter:
+    """
+    Write a PNG from horizontal bands, so the full image never has to exist in memory.
+    Bands must be written top to bottom and add up to the declared height. The file is written
+    under a temporary name and only renamed to path once it is complete.
+    """
+
+    def __init__(self, path, width, height, mode, compress_level=6):
+        if mode not in COLOR_TYPES:
+            raise ValueError(f"Unsupported PNG mode: {mode}")
+        color_type, self.bpp = COLOR_TYPES[mode]
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows_written = 0
+        self.prev_row = None
+        self.compressor = zlib.compressobj(compress_level)
+        self.path = path
+        self.tmp_path = temp_path(path)
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(PNG_SIGNATURE)
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def write(self, band):
+        if band.mode != self.mode or band.width != self.width:
+            raise ValueError("Band does not match the PNG mode or width.")
+        data = self.compressor.compress(self.filter_rows(band))
+        if data:
+            self.write_chunk(b"IDAT", data)
+        self.rows_written += band.height
+
+    def filter_rows(self, band):
+        stride = self.width * self.bpp
+        raw = band.tobytes()
+        if np is None:
+            # Filter type 0 (None) on every row
+            return b"".join(b"\x00" + raw[i:i+stride] for i in range(0, len(raw), stride))
+        # Filter type 2 (Up): difference to the previous row, which compresses photos much better
+        rows = np.frombuffer(raw, dtype=np.uint8).reshape(band.height, stride)
+        prev = np.vstack([self.prev_row if self.prev_row is not None else np.zeros((1, stride), np.uint8), rows[:-1]])
+        self.prev_row = rows[-1:].copy()
+        filtered = np.empty((band.height, stride + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[:, 1:] = rows - prev
+        return filtered.tobytes()
+
+    def close(self):
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f"PNG expects {self.height} rows, {self.rows_written} were written.")
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        # Drop the incomplete file, an existing file at path stays untouched
+        self.file.close()
+        os.remove(self.tmp_path)
+
+    def write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,293 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_server.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: Local HTTP service that queues collage jobs and runs them on a bounded worker pool
+
+
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from collage import create_collage, CollageCancelled
+from collage_batch import collage_params
+from collage_cache import ImageCache, MemoryCache, DEFAULT_CACHE_SIZE
+
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+# Fields of a job record that are reported by the status endpoints
+JOB_FIELDS = ("id", "status", "output", "error", "progress", "submitted", "queue_seconds", "run_seconds", "metrics")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Runs job specs (the batch runner's format) on a bounded thread pool with a shared image cache.
+    At most max_queue jobs wait; finished jobs are kept for the status endpoints up to history entries.
+    """
+
+    def __init__(self, workers=2, max_queue=100, cache=None, history=1000, root=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.history = history
+        self.root = os.path.abspath(root) if root else None
+        self.cache = cache if cache is not None else MemoryCache()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="collage-job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, spec):
+        params = self.job_params(spec)
+        with self.lock:
+            if self.count("queued") >= self.max_queue:
+                raise QueueFull(f"Queue is full ({self.max_queue} jobs waiting)")
+            job = {"id": uuid.uuid4().hex[:12], "status": "queued", "output": params["output"], "error": None,
+                   "progress": None, "submitted": time.time(), "queued_at": time.perf_counter(),
+                   "queue_seconds": None, "run_seconds": None, "metrics": None, "cancel": threading.Event()}
+            self.jobs[job["id"]] = job
+            self.trim()
+        self.pool.submit(self.run, job, params)
+        return self.view(job)
+
+    def job_params(self, spec):
+        """
+        create_collage keyword arguments for a spec. Besides the batch format (input_folder, output_folder,
+        output_file) the create_collage names input_dir and output are accepted.
+        """
+        spec = dict(spec)
+        if "input_dir" in spec:
+            spec.setdefault("input_folder", spec.pop("input_dir"))
+        if "output" in spec:
+            output = spec.pop("output")
+            spec.setdefault("output_folder", os.path.dirname(output) or ".")
+            spec.setdefault("output_file", os.path.basename(output))
+        if "input_folder" not in spec:
+            raise ValueError("The job spec needs an input_folder.")
+        params = collage_params(spec)
+        if self.root is not None:
+            for key in ("input_dir", "output", "save_layout"):
+                if not params.get(key):
+                    continue
+                path = os.path.abspath(params[key])
+                if os.path.commonpath([path, self.root]) != self.root:
+                    raise ValueError(f"{key} must be inside {self.root}")
+        return params
+
+    def run(self, job, params):
+        with self.lock:
+            if job["cancel"].is_set():
+                return
+            job["status"] = "running"
+            job["queue_seconds"] = round(time.perf_counter() - job["queued_at"], 3)
+        started = time.perf_counter()
+        metrics = {}
+
+        def progress(stage, done, total):
+            job["progress"] = {"stage": stage, "done": done, "total": total}
+
+        try:
+            result = create_collage(cache=self.cache, metrics=metrics, progress=progress, cancel=job["cancel"].is_set,
+                                    **params)
+            status, error = ("done", None) if result else ("failed", "No images found")
+        except CollageCancelled:
+            status, error = "cancelled", None
+        except Exception as e:
+            status, error = "failed", str(e)
+        with self.lock:
+            job.update(status=status, error=error, metrics=self.job_metrics(metrics),
+                       run_seconds=round(time.perf_counter() - started, 3))
+
+    @staticmethod
+    def job_metrics(metrics):
+        # CPU time and peak memory are measured for the whole process, which runs several jobs at once,
+        # so only the stage wall times and the counters belong to the job
+        if not metrics:
+            return None
+        stages = {name: {"wall": round(stage["wall"], 3)} for name, stage in metrics.get("stages", {}).items()}
+        return {"stages": stages, "counters": metrics.get("counters")}
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job["cancel"].set()
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+            return self.view(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self.view(job) if job else None
+
+    def list(self):
+        with self.lock:
+            return [self.view(job) for job in self.jobs.values()]
+
+    def status(self):
+        with self.lock:
+            counts = {s: self.count(s) for s in ("queued", "running", "done", "failed", "cancelled")}
+            run_times = [job["run_seconds"] for job in self.jobs.values() if job["status"] == "done"]
+        return {"workers": self.workers, "max_queue": self.max_queue, "jobs": counts,
+                "mean_run_seconds": round(sum(run_times) / len(run_times), 3) if run_times else None}
+
+    def count(self, status):
+        return sum(1 for job in self.jobs.values() if job["status"] == status)
+
+    def trim(self):
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("done", "failed", "cancelled")]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def view(job):
+        return {key: job[key] for key in JOB_FIELDS}
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job["cancel"].set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class CollageRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs              submit a job spec (JSON), returns the job
+    GET  /jobs              all known jobs
+    GET  /jobs/<id>         status, progress, timings and stage metrics of a job
+    GET  /jobs/<id>/result  the collage file of a finished job
+    DELETE /jobs/<id>       cancel a queued or running job
+    GET  /status            worker count, queue limit and job counts
+    """
+
+    queue = None  # set by serve()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["status"]:
+            return self.send_json(200, self.queue.status())
+        if parts == ["jobs"]:
+            return self.send_json(200, self.queue.list())
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.queue.get(parts[1])
+            if job is None:
+                return self.send_json(404, {"error": "Unknown job"})
+            if len(parts) == 2:
+                return self.send_json(200, job)
+            if parts[2] == "result":
+                return self.send_result(job)
+        self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            return self.send_json(404, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(spec, dict):
+                raise ValueError("The job spec must be a JSON object.")
+            job = self.queue.submit(spec)
+        except QueueFull as e:
+            return self.send_json(503, {"error": str(e)})
+        except (ValueError, TypeError) as e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_json(202, job)
+
+    def do_DELETE(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self.queue.cancel(parts[1])
+            if job is not None:
+                return self.send_json(200, job)
+        self.send_json(404, {"error": "Unknown job"})
+
+    def send_result(self, job):
+        if job["status"] != "done":
+            return self.send_json(409, {"error": f"Job is {job['status']}"})
+        try:
+            with open(job["output"], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            return self.send_json(410, {"error": str(e)})
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(job["output"])[1].lower(),
+                                                           "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, code, data):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def serve(host="127.0.0.1", port=8765, queue=None):
+    handler = type("Handler", (CollageRequestHandler,), {"queue": queue or JobQueue()})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving collages on http://{host}:{server.server_port} "
+          f"({handler.queue.workers} workers, up to {handler.queue.max_queue} queued jobs)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        handler.queue.shutdown()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Serve collage generation over HTTP on localhost")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="Jobs rendered at the same time")
+    parser.add_argument("--max-queue", type=int, default=100, help="Jobs that may wait; more are rejected with 503")
+    parser.add_argument("--history", type=int, default=1000, help="Finished jobs kept for the status endpoints")
+    parser.add_argument("--root", default=None, help="Only allow input and output paths inside this folder")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024),
+                        help="Size limit of the shared in-memory image pool in MB")
+    parser.add_argument("--cache", default=None, help="Use this on-disk cache directory instead of the in-memory pool")
+    args = parser.parse_args()
+
+    cache = ImageCache(args.cache) if args.cache else MemoryCache(args.pool_size * 1024*1024)
+    try:
+        serve(args.host, args.port, JobQueue(args.workers, args.max_queue, cache, args.history, args.root))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,259 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) 2025 Michael Gasche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ------------------------------------------------------------------------------
+
+# File:        collage_watch.py
+# Version:     1.1
+# Author:      Michael Gasche
+# Created:     2025-12
+# Product:     Collage
+# Description: Watch mode that keeps images decoded in memory and regenerates a collage when its input folder changes
+
+
+import os
+import sys
+import time
+import random
+import select
+import struct
+import argparse
+import ctypes
+import ctypes.util
+
+from collage import create_collage, walk_images, state_path, sized_output, output_sizes, IMAGE_EXTENSIONS
+from collage_batch import load_jobs, collage_params
+from collage_cache import MemoryCache, DEFAULT_CACHE_SIZE
+
+# inotify event bits (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class InotifyWatcher:
+    """
+    Change notifications for a folder (and its subfolders if recursive) through the Linux inotify API.
+    Names accepted by ignore() (e.g. the collage itself) do not count as changes.
+    """
+
+    def __init__(self, directory, recursive=False, ignore=None):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc = libc
+        self.recursive = recursive
+        self.ignore = ignore or (lambda path: False)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+        self.add_watch(directory)
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+        self.paths[wd] = directory
+        if self.recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False):
+                    self.add_watch(entry.path)
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds (None = forever) and return True if anything relevant changed
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        changed = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            path = os.path.join(self.paths.get(wd, ""), os.fsdecode(name))
+            if self.recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.add_watch(path)
+                except OSError:
+                    pass  # already gone again
+            if not self.ignore(path):
+                changed = True
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Portable fallback: compares size and modification time of the image files every interval seconds
+    """
+
+    def __init__(self, directory, recursive=False, include=None, exclude=None, interval=2.0):
+        self.directory = directory
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for _, path in walk_images(self.directory, self.recursive, self.include, self.exclude):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if remaining <= 0:
+                return False
+            time.sleep(remaining)
+            snapshot = self.scan()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return True
+
+    def close(self):
+        pass
+
+
+def make_watcher(params, ignore, polling=False, interval=2.0):
+    # inotify where available (Linux), polling otherwise
+    folder = params["input_dir"]
+    recursive = params.get("recursive", False)
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder, recursive, ignore)
+        except OSError as e:
+            print(f"inotify not available ({e}), polling every {interval:g}s")
+    return PollingWatcher(folder, recursive, params.get("include"), params.get("exclude"), interval)
+
+
+def own_outputs(params):
+    # Every file a run writes: the collage, its additional sizes and the saved layout
+    output = params["output"]
+    sizes = output_sizes(params.get("sizes"), params["width"], params["height"])
+    paths = [output] + [sized_output(output, w, h) for w, h in sizes]
+    if params.get("save_layout"):
+        paths.append(params["save_layout"])
+    return [os.path.abspath(path) for path in paths]
+
+
+def watch_params(spec):
+    # create_collage keyword arguments for a job spec, including the input selection
+    params = collage_params(spec)
+    if params.get("seed") is None:
+        # One seed for the whole session, so the wall only changes where the images do
+        params["seed"] = random.SystemRandom().randrange(2**32)
+        print(f"Seed: {params['seed']}")
+    folder = os.path.abspath(params["input_dir"])
+    # Never use the collage itself (or any other file the run writes) as an input
+    own = [os.path.relpath(path, folder).replace(os.sep, "/") for path in own_outputs(params)
+           if path.startswith(folder + os.sep)]
+    if own:
+        params["exclude"] = list(params.get("exclude") or []) + own
+    return params
+
+
+def ignored(params):
+    # Files written by the collage run itself (outputs and layout state) and hidden files, which includes
+    # the temporary files they are written to
+    own = set(own_outputs(params)) | {os.path.abspath(state_path(params["output"]))}
+
+    def ignore(path):
+        name = os.path.basename(path)
+        if os.path.abspath(path) in own or name.startswith("."):
+            return True
+        return bool(os.path.splitext(name)[1]) and not name.lower().endswith(IMAGE_EXTENSIONS)
+    return ignore
+
+
+def regenerate(params, cache):
+    started = time.perf_counter()
+    try:
+        if create_collage(cache=cache, **params) is None:
+            print(f"No images found in {params['input_dir']}")
+        else:
+            print(f"Regenerated in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        # Keep watching; the next change may fix it (e.g. a file that was still being copied)
+        print(f"Error: {e}")
+
+
+def watch(spec, debounce=2.0, polling=False, interval=2.0, pool_size=DEFAULT_CACHE_SIZE):
+    """
+    Generate the collage of a job spec, then regenerate it whenever the input folder changes.
+    Bursts of changes are collected until debounce seconds pass without one. Image metadata and
+    decoded images stay in memory between runs, and the output is replaced atomically.
+    """
+    params = watch_params(spec)
+    cache = MemoryCache(pool_size)
+    watcher = make_watcher(params, ignored(params), polling, interval)
+    try:
+        regenerate(params, cache)
+        while True:
+            if not watcher.wait():
+                continue
+            while watcher.wait(debounce):
+                pass
+            regenerate(params, cache)
+    finally:
+        watcher.close()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Regenerate a collage whenever its input folder changes")
+    parser.add_argument("job", help="JSON job spec (e.g. a saved GUI config) with input folder, output and options")
+    parser.add_argument("--debounce", type=float, default=2.0, help="Seconds without changes before regenerating")
+    parser.add_argument("--poll", action="store_true", help="Poll the folder instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between polls")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024),
+                        help="Size limit of the in-memory image pool in MB")
+    args = parser.parse_args()
+
+    specs = load_jobs([args.job])
+    if len(specs) != 1:
+        parser.error("The job file must hold exactly one job spec.")
+    try:
+        watch(specs[0], args.debounce, args.poll, args.poll_interval, args.pool_size * 1024*1024)
+    except KeyboardInterrupt:
+        pass
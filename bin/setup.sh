@@ -1,7 +1,7 @@
 #!/bin/bash
 # ------------------------------------------------------------------------------
 # setup.sh
-# macOS (Intel/ARM64) - Python env, venv, PySide6 + Pillow + PyInstaller/pyenc
+# macOS (Intel/ARM64) - Python env, venv, PySide6 + Pillow + NumPy + PyInstaller/pyenc
 # ------------------------------------------------------------------------------
 
 set -e
@@ -63,12 +63,13 @@ pip install --upgrade pip setuptools wheel
 
 # --- 8. Install required packages ---
 echo "==> Installing required packages..."
-pip install PySide6 pillow pyinstaller
+pip install PySide6 pillow numpy pyinstaller
 
 # --- 9. Check installed packages ---
 echo "==> Installed packages:"
 python -m pip show PySide6
 python -m pip show pillow
+python -m pip show numpy
 python -m pip show pyinstaller
 python --version
 